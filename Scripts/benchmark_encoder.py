@@ -0,0 +1,114 @@
+import argparse
+import json
+import logging
+import time
+import numpy as np
+import pandas as pd
+from encoder import ENCODER_BACKENDS, ENCODER_MIN_COSINE, load_encoder
+
+# Compares the encoder backends on the same texts: model load time, single query latency (one question
+# per encode call, like generate_question_embedding), batch throughput (like ingestion) and the cosine
+# similarity of every embedding to the one of the 'torch' backend, checked against ENCODER_MIN_COSINE.
+# The 'torch' backend is always measured first, as ENCODER_MIN_COSINE is defined against it.
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def benchmark_backend(model_name, backend, questions, documents, batch_size=64, warmup=10):
+    """
+    Measures one backend. Returns the results and the embeddings of the documents.
+    """
+    start = time.perf_counter()
+    model = load_encoder(model_name, backend)
+    load_time = time.perf_counter() - start
+
+    for question in questions[:warmup]:
+        model.encode(question)
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        model.encode(question)
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = np.asarray(latencies) * 1000
+
+    start = time.perf_counter()
+    embeddings = model.encode(documents, batch_size=batch_size)
+    batch_time = time.perf_counter() - start
+
+    results = {
+        'load_s': load_time,
+        'single_p50_ms': float(np.percentile(latencies_ms, 50)),
+        'single_p95_ms': float(np.percentile(latencies_ms, 95)),
+        'single_mean_ms': float(latencies_ms.mean()),
+        'batch_texts_per_second': len(documents) / batch_time if batch_time else 0.0
+    }
+    return results, normalize(embeddings)
+
+
+def compare_embeddings(reference, embeddings, backend):
+    """
+    Cosine similarity of every embedding to the reference embedding of the same text.
+    """
+    cosines = np.sum(reference * embeddings, axis=1)
+    min_cosine = ENCODER_MIN_COSINE[backend]
+    return {
+        'cosine_mean': float(cosines.mean()),
+        'cosine_min': float(cosines.min()),
+        'min_cosine_allowed': min_cosine,
+        'compatible': bool(cosines.min() >= min_cosine)
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark the encoder backends against each other.")
+    parser.add_argument('--backends', nargs='+', choices=ENCODER_BACKENDS, default=ENCODER_BACKENDS,
+                        help="Backends to measure; 'torch' is always added as the reference for the embedding check.")
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--texts', default='./Data/ground_truth.csv',
+                        help="CSV with question and answer columns: questions are encoded one by one, answers in batches.")
+    parser.add_argument('--num-questions', type=int, default=200)
+    parser.add_argument('--num-documents', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--output', default=None, help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.texts)
+    questions = df['question'].dropna().astype(str).tolist()[:args.num_questions]
+    documents = df['answer'].dropna().astype(str).tolist()[:args.num_documents]
+
+    report = {'model': args.model, 'reference': 'torch', 'questions': len(questions),
+              'documents': len(documents), 'batch_size': args.batch_size, 'backends': {}}
+    backends = ['torch'] + [backend for backend in args.backends if backend != 'torch']
+    reference = None
+    for backend in backends:
+        try:
+            results, embeddings = benchmark_backend(args.model, backend, questions, documents, args.batch_size)
+        except Exception as e:
+            if backend == 'torch':
+                raise SystemExit(f"The torch reference backend failed: {e}")
+            logging.error(f"Backend {backend} failed: {e}")
+            report['backends'][backend] = {'error': str(e)}
+            continue
+        if reference is None:
+            reference = embeddings
+        results.update(compare_embeddings(reference, embeddings, backend))
+        report['backends'][backend] = results
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    print(f"\n{'backend':<14}{'load s':>8}{'p50 ms':>9}{'p95 ms':>9}{'texts/s':>10}{'min cos':>9}  compatible")
+    for backend, results in report['backends'].items():
+        if 'error' in results:
+            print(f"{backend:<14}failed: {results['error']}")
+            continue
+        print(f"{backend:<14}{results['load_s']:>8.2f}{results['single_p50_ms']:>9.2f}{results['single_p95_ms']:>9.2f}"
+              f"{results['batch_texts_per_second']:>10.1f}{results['cosine_min']:>9.4f}  {results['compatible']}")
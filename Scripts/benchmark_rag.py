@@ -0,0 +1,237 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from openai import OpenAI
+import rag
+import resources
+from fake_openai_server import start_server
+from local_index import LocalVectorIndex
+
+# End-to-end benchmark of the RAG pipeline. Every question runs the stages of get_answer one by one
+# (embedding, retrieval, prompt, llm, relevance) so each can be timed on its own. The LLM is served
+# by the local fake OpenAI server unless --openai-base-url is given, and retrieval can use Elasticsearch,
+# a snapshot or an in-memory index built from the ground truth answers, so runs are repeatable offline.
+STAGES = ['embedding', 'retrieval', 'prompt', 'llm', 'relevance']
+
+
+def current_rss_mb():
+    """
+    Resident memory of this process in MB (Linux), or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak / 1024 ** 2 if platform.system() == 'Darwin' else peak / 1024
+
+
+def summarize(values):
+    """
+    Latency percentiles in milliseconds of a list of durations in seconds.
+    """
+    values_ms = np.asarray(values) * 1000
+    if len(values_ms) == 0:
+        return {'count': 0}
+    return {
+        'count': int(len(values_ms)),
+        'mean_ms': float(values_ms.mean()),
+        'p50_ms': float(np.percentile(values_ms, 50)),
+        'p95_ms': float(np.percentile(values_ms, 95)),
+        'p99_ms': float(np.percentile(values_ms, 99)),
+        'max_ms': float(values_ms.max())
+    }
+
+
+def run_question(question, backend, k=5, use_embedding_cache=False):
+    """
+    Runs the pipeline stages of get_answer for one question and returns their durations in seconds.
+    """
+    timings = {}
+    start = time.perf_counter()
+    question_embedding = rag.generate_question_embedding(question, use_cache=use_embedding_cache)
+    timings['embedding'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hits = rag.search_documents(question_embedding, k=k, backend=backend)
+    timings['retrieval'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prompt = rag.build_prompt(question, rag.create_context(hits))
+    timings['prompt'] = time.perf_counter() - start
+
+    # Streamed like in the app, so the time covers generating every token
+    start = time.perf_counter()
+    result = {}
+    answer = ''.join(rag.llm_stream(prompt, result))
+    timings['llm'] = time.perf_counter() - start
+    if result['failed']:
+        raise RuntimeError(answer)
+
+    start = time.perf_counter()
+    rag.evaluate_relevance(question, answer, question_embedding)
+    timings['relevance'] = time.perf_counter() - start
+
+    timings['total'] = sum(timings.values())
+    return timings
+
+
+def build_synthetic_index(documents):
+    """
+    In-memory retrieval over the given texts, for benchmarks without Elasticsearch.
+    """
+    embeddings = resources.get_embedding_model().encode(documents, batch_size=256)
+    return LocalVectorIndex([str(i) for i in range(len(documents))], documents, embeddings)
+
+
+def run_benchmark(questions, backend, concurrency=1, warmup=5, k=5, use_embedding_cache=False):
+    """
+    Runs every question through the pipeline with concurrency worker threads.
+    Returns per-stage and total latency percentiles, throughput and memory use.
+    """
+    for question in questions[:warmup]:
+        run_question(question, backend, k, use_embedding_cache)
+
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(question):
+        try:
+            timings = run_question(question, backend, k, use_embedding_cache)
+            with lock:
+                results.append(timings)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, questions))
+    wall_time = time.perf_counter() - start
+
+    if errors:
+        logging.error(f"{len(errors)} questions failed, e.g.: {errors[0]}")
+    return {
+        'questions': len(questions),
+        'errors': len(errors),
+        'wall_time_s': wall_time,
+        'throughput_qps': len(results) / wall_time if wall_time else 0.0,
+        'stages': {stage: summarize([timings[stage] for timings in results]) for stage in STAGES},
+        'total': summarize([timings['total'] for timings in results]),
+        'memory': {
+            'rss_before_mb': rss_before,
+            'rss_after_mb': current_rss_mb(),
+            'peak_rss_mb': peak_rss_mb()
+        }
+    }
+
+
+def flatten(results, prefix=''):
+    """
+    Flattens nested result dictionaries into {'stages.llm.p95_ms': value} pairs of numbers.
+    """
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_results(baseline, current):
+    """
+    Returns (metric, baseline, current, change in percent) for every numeric metric of two runs.
+    """
+    base_flat, current_flat = flatten(baseline.get('results', baseline)), flatten(current.get('results', current))
+    rows = []
+    for metric in sorted(set(base_flat) & set(current_flat)):
+        old, new = base_flat[metric], current_flat[metric]
+        change = (new - old) / old * 100 if old else None
+        rows.append((metric, old, new, change))
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline stage by stage with local stand-ins.")
+    parser.add_argument('--questions', default='./Data/ground_truth.csv', help="CSV with a question column.")
+    parser.add_argument('--num-questions', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=1, help="Questions processed in parallel.")
+    parser.add_argument('--warmup', type=int, default=5, help="Questions run before measuring.")
+    parser.add_argument('--k', type=int, default=5, help="Documents retrieved per question.")
+    parser.add_argument('--backend', choices=['memory', 'local', 'elasticsearch'], default='memory',
+                        help="'memory' indexes the ground truth answers in process, 'local' uses LOCAL_INDEX_SNAPSHOT "
+                             "or the Elasticsearch index loaded into memory, 'elasticsearch' searches the index.")
+    parser.add_argument('--embedding-cache', action='store_true', help="Use the question embedding cache.")
+    parser.add_argument('--openai-base-url', default=None,
+                        help="OpenAI compatible endpoint; a local fake server is started when omitted.")
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="Fake server: seconds until the answer.")
+    parser.add_argument('--llm-tokens-per-second', type=float, default=0.0,
+                        help="Fake server: answer generation speed (0 = no delay).")
+    parser.add_argument('--output', default=None, help="Write the results as JSON to this file.")
+    parser.add_argument('--compare', default=None, help="JSON results of an earlier run to compare with.")
+    args = parser.parse_args()
+
+    stub = None
+    base_url = args.openai_base_url
+    if base_url is None:
+        stub = start_server(port=0, latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second)
+        base_url = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+    # The stub accepts any key
+    resources.set_resource('openai_client', OpenAI(api_key=os.getenv('OPENAI_API_KEY', 'benchmark'), base_url=base_url))
+
+    df = pd.read_csv(args.questions)
+    questions = df['question'].dropna().astype(str).tolist()[:args.num_questions]
+    backend = args.backend
+    if backend == 'memory':
+        rag.local_index = build_synthetic_index(df['answer'].dropna().astype(str).tolist())
+        backend = 'local'
+
+    results = run_benchmark(questions, backend, concurrency=args.concurrency, warmup=args.warmup, k=args.k,
+                            use_embedding_cache=args.embedding_cache)
+    report = {
+        'config': {
+            'backend': args.backend,
+            'questions': len(questions),
+            'concurrency': args.concurrency,
+            'k': args.k,
+            'embedding_cache': args.embedding_cache,
+            'llm': 'fake' if stub else base_url,
+            'llm_latency': args.llm_latency if stub else None,
+            'es_search_mode': rag.ES_SEARCH_MODE,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': results
+    }
+    if stub is not None:
+        stub.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\n{'metric':<36}{'baseline':>14}{'current':>14}{'change':>10}")
+        for metric, old, new, change in compare_results(baseline, report):
+            change_text = f"{change:+.1f}%" if change is not None else 'n/a'
+            print(f"{metric:<36}{old:>14.3f}{new:>14.3f}{change_text:>10}")
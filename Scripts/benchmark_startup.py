@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures the startup of the RAG module in fresh interpreters: the time to import rag.py, the time until the
+# first question is embedded (which loads the model on first use) and a second question for comparison.
+# --preload builds every shared resource right after the import, like the module did before resources.py.
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import rag
+import resources
+if {preload}:
+    resources.preload()
+imported = time.perf_counter()
+rag.generate_question_embedding('Which moisturizer suits dry skin?', use_cache=False)
+first = time.perf_counter()
+rag.generate_question_embedding('Is this serum fragrance free?', use_cache=False)
+second = time.perf_counter()
+print(json.dumps({{
+    'import_s': imported - start,
+    'first_request_s': first - imported,
+    'time_to_first_request_s': first - start,
+    'second_request_s': second - first,
+    'build_times': resources.build_times
+}}))
+"""
+
+
+def run_probe(preload=False):
+    """
+    Runs the probe in a new interpreter and returns its timings.
+    """
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [scripts_dir, os.getenv('PYTHONPATH')])))
+    env.setdefault('OPENAI_API_KEY', 'startup-benchmark')  # No API calls are made, the client only needs a key
+    result = subprocess.run([sys.executable, '-c', PROBE.format(preload=preload)], env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import time and time to first request of rag.py.")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters per mode.")
+    parser.add_argument('--output', default=None, help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    report = {}
+    for mode, preload in [('lazy', False), ('preload', True)]:
+        runs = [run_probe(preload) for _ in range(args.runs)]
+        report[mode] = {
+            metric: statistics.median(run[metric] for run in runs)
+            for metric in ['import_s', 'first_request_s', 'time_to_first_request_s', 'second_request_s']
+        }
+        report[mode]['build_times'] = runs[-1]['build_times']
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
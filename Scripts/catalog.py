@@ -0,0 +1,29 @@
+import logging
+import time
+
+
+def get_catalog_version(es_client, index_name='cosmetics_index'):
+    """
+    Returns the catalog version stored in the index mapping metadata, or None.
+    """
+    try:
+        response = es_client.indices.get_mapping(index=index_name)
+        for mapping in response.values():
+            return mapping['mappings'].get('_meta', {}).get('catalog_version')
+    except Exception as e:
+        logging.error(f"Error reading the catalog version: {e}")
+    return None
+
+
+def bump_catalog_version(es_client, index_name='cosmetics_index'):
+    """
+    Stores a new catalog version in the index mapping metadata after the catalog was re-indexed,
+    so that processes holding data derived from the old catalog can invalidate it.
+    """
+    version = str(time.time_ns())
+    try:
+        es_client.indices.put_mapping(index=index_name, body={"_meta": {"catalog_version": version}})
+        logging.info(f"Catalog version of '{index_name}' set to {version}.")
+    except Exception as e:
+        logging.error(f"Error updating the catalog version: {e}")
+    return version
@@ -0,0 +1,157 @@
+import os
+
+# Product documents are indexed as chunks: every long text field is split into windows that fit the
+# CHUNK_MAX_TOKENS word pieces MiniLM reads (longer inputs are truncated), title and special tokens included,
+# overlapping by CHUNK_OVERLAP_TOKENS word pieces. Each chunk starts with the brand and product name, so it
+# can be matched on its own, and keeps the id of its product in parent_id.
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '256'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '48'))
+# Without the model tokenizer (e.g. with the embedding service) windows are counted in words instead.
+# Ingredient lists and reviews average up to about 2 word pieces per word, so 100 words stay within 256 pieces.
+CHUNK_MAX_WORDS = int(os.getenv('CHUNK_MAX_WORDS', '100'))
+CHUNK_OVERLAP_WORDS = int(os.getenv('CHUNK_OVERLAP_WORDS', '20'))
+
+# Long fields that are chunked, in chunk order; the short ones are copied into every chunk
+CHUNK_FIELDS = ['about', 'ingredients', 'reviews']
+PRODUCT_FIELDS = ['brand_name', 'cosmetic_name', 'price', 'recommended']
+CHUNK_ID_SEPARATOR = ':'
+
+
+def split_words(text, max_words=CHUNK_MAX_WORDS, overlap=CHUNK_OVERLAP_WORDS):
+    """
+    Splits a text into windows of at most max_words words, overlapping by overlap words.
+    """
+    words = text.split()
+    if len(words) <= max_words:
+        return [' '.join(words)] if words else []
+    step = max(1, max_words - overlap)
+    windows = []
+    for start in range(0, len(words), step):
+        windows.append(' '.join(words[start:start + max_words]))
+        if start + max_words >= len(words):
+            break
+    return windows
+
+
+def split_tokens(text, tokenizer, max_tokens, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits a text into windows of at most max_tokens word pieces of the tokenizer, overlapping by overlap pieces.
+    Windows are cut from the original text at word boundaries.
+    """
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)['offset_mapping']
+    if len(offsets) <= max_tokens:
+        return [text.strip()] if offsets else []
+    step = max(1, max_tokens - overlap)
+
+    def word_start(i):
+        return i == 0 or i == len(offsets) or text[offsets[i][0] - 1].isspace()
+
+    windows = []
+    end = 0
+    for window_start in range(0, len(offsets), step):
+        # Skip the rest of a word cut by the overlap, but never past the end of the previous window,
+        # and keep the raw token window when a long word leaves no word boundary to move to
+        start = window_start
+        last_start = min(window_start + step - 1, end, len(offsets) - 1)
+        while start < last_start and not word_start(start):
+            start += 1
+        if not word_start(start):
+            start = window_start
+        # End the window with a whole word, or cut the word when it fills the whole step
+        end = min(start + max_tokens, len(offsets))
+        cut_end = end
+        while end > window_start + step and not word_start(end):
+            end -= 1
+        if not word_start(end):
+            end = cut_end
+        windows.append(text[offsets[start][0]:offsets[end - 1][1]])
+        if end == len(offsets):
+            break
+    return windows
+
+
+def count_pieces(text, tokenizer):
+    return len(tokenizer(text, add_special_tokens=False, verbose=False)['input_ids'])
+
+
+def chunk_id(parent_id, chunk_index):
+    return f"{parent_id}{CHUNK_ID_SEPARATOR}{chunk_index}"
+
+
+def parent_id_of(hit):
+    """
+    Returns the product id of a search hit; documents indexed before chunking are their own product.
+    """
+    parent_id = hit.get('_source', {}).get('parent_id')
+    return parent_id or hit['_id'].split(CHUNK_ID_SEPARATOR, 1)[0]
+
+
+def chunk_product(fields, tokenizer=None):
+    """
+    Splits the fields of one product into chunks, sized with the tokenizer of the embedding model when given.
+    Returns dicts with the chunk field, the text to embed and the fields to store with the chunk.
+    A product without long fields gets a single 'overview' chunk.
+    """
+    product = {field: fields[field] for field in PRODUCT_FIELDS if fields.get(field)}
+    title = ' '.join(product[field] for field in ['brand_name', 'cosmetic_name'] if field in product)
+    chunks = []
+    for field in CHUNK_FIELDS:
+        label = field.replace('_', ' ').title()
+        prefix = f"{title}. {label}: " if title else f"{label}: "
+        text = fields.get(field) or ''
+        if tokenizer is not None:
+            # [CLS] and [SEP] take two of the pieces the model reads
+            max_tokens = max(CHUNK_OVERLAP_TOKENS + 1, CHUNK_MAX_TOKENS - 2 - count_pieces(prefix, tokenizer))
+            windows = split_tokens(text, tokenizer, max_tokens)
+        else:
+            windows = split_words(text)
+        for window in windows:
+            chunks.append({
+                'chunk_field': field,
+                'text': prefix + window,
+                'fields': dict(product, **{field: window})
+            })
+    if not chunks:
+        details = ' '.join(f"{field.replace('_', ' ').title()}: {value}" for field, value in product.items())
+        chunks.append({'chunk_field': 'overview', 'text': details, 'fields': product})
+    return chunks
+
+
+def group_chunk_hits(hits, k=5, chunks_per_product=3):
+    """
+    Groups chunk hits by product and returns the top k products, each scored by its best chunk.
+    The text and fields of a product hit combine its best chunks_per_product chunks, so the
+    context only carries the parts of a product that matched the question.
+    """
+    products = {}
+    for hit in sorted(hits, key=lambda hit: hit['_score'], reverse=True):
+        parent_id = parent_id_of(hit)
+        product = products.get(parent_id)
+        if product is None:
+            if len(products) == k:
+                continue
+            product = products[parent_id] = {'_id': parent_id, '_score': hit['_score'], 'chunks': []}
+        if len(product['chunks']) < chunks_per_product:
+            product['chunks'].append(hit)
+
+    grouped = []
+    for parent_id, product in products.items():
+        chunks = product['chunks']
+        fields = None
+        if all(chunk['_source'].get('fields') for chunk in chunks):
+            fields = {}
+            for chunk in chunks:
+                for field, value in chunk['_source']['fields'].items():
+                    if field not in fields:
+                        fields[field] = value
+                    elif field in CHUNK_FIELDS and value not in fields[field]:
+                        fields[field] = f"{fields[field]} ... {value}"
+        source = {
+            'id': parent_id,
+            'text': '\n'.join(chunk['_source'].get('text', '') for chunk in chunks),
+            'chunks': [chunk['_id'] for chunk in chunks]
+        }
+        if fields is not None:
+            source['fields'] = fields
+        grouped.append({'_id': parent_id, '_score': product['_score'], '_source': source})
+    return grouped
@@ -1,9 +1,19 @@
 import pandas as pd
 import hashlib
+import argparse
+import os
+import time
+import io
+import urllib.request
+from contextlib import contextmanager
 from elasticsearch import Elasticsearch, ConnectionError, TransportError
-from elasticsearch.helpers import bulk
-from sentence_transformers import SentenceTransformer
+from elasticsearch.helpers import bulk, streaming_bulk, parallel_bulk, scan
+from encoder import supports_multi_process
+from resources import EMBEDDING_SERVICE_URL, get_embedding_model
 import json
+from embedding_snapshot import SNAPSHOT_DTYPES, export_snapshot_from_elasticsearch
+from catalog import bump_catalog_version
+from chunking import chunk_product, chunk_id, parent_id_of
 
 # Initialize Elasticsearch client
 es = Elasticsearch("http://localhost:9200")
@@ -19,12 +29,55 @@ except ConnectionError as e:
 
 # Load a pre-trained embedding model to be globally accessible
 model_name = 'all-MiniLM-L6-v2' # 'all-MiniLM-L6-v2' 'text-embedding-ada-002'
-embedding_model = SentenceTransformer(model_name)
+embedding_model = get_embedding_model()  # Backend set with ENCODER_BACKEND, or the EMBEDDING_SERVICE_URL client
+# Chunks are sized in word pieces of the model; the embedding service client has no tokenizer, so then in words
+chunk_tokenizer = getattr(embedding_model, 'tokenizer', None)
+
+# Batched embedding settings: rows are encoded in batches of EMBEDDING_BATCH_SIZE,
+# optionally spread over EMBEDDING_WORKERS CPU processes
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '256'))
+EMBEDDING_WORKERS = int(os.getenv('EMBEDDING_WORKERS', '1'))
+
+# Streaming ingestion settings: CSV rows read per chunk, documents per bulk request
+# and number of threads sending bulk requests
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '1000'))
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '500'))
+BULK_THREAD_COUNT = int(os.getenv('BULK_THREAD_COUNT', '1'))
+
+# Vector field settings: the embedding is indexed in an HNSW graph for approximate kNN search.
+# VECTOR_INDEX_TYPE=int8_hnsw or bbq_hnsw keeps int8 or binary quantized copies of the vectors in the graph
+# (about 4x and 30x less memory than float32); rescore with ES_RESCORE_WINDOW in rag.py to recover recall
+VECTOR_INDEX_TYPES = ['hnsw', 'int8_hnsw', 'bbq_hnsw']
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'hnsw')
+VECTOR_SIMILARITY = os.getenv('VECTOR_SIMILARITY', 'cosine')
+HNSW_M = int(os.getenv('HNSW_M', '16'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '100'))
+
+# Catalog CSV: a local path or an http(s) URL, overridden with --source
+CATALOG_SOURCE = os.getenv('CATALOG_SOURCE', 'https://raw.githubusercontent.com/ovlasenko-ellation/LLM_project3/refs/heads/main/Data/Sephora_all.csv')
+
+# All columns are read as strings so that the row hash used as the document id does not
+# depend on per-chunk dtype inference (e.g. ints turning into floats in a chunk with NaNs)
+CSV_DTYPE = str
+
+
+@contextmanager
+def open_source(file_path):
+    """
+    Opens a local CSV path as is, or an http(s) URL as a text stream. pandas reads a URL given as a
+    string into memory in one piece, while a stream is read block by block like a local file.
+    """
+    if file_path.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(file_path) as response:
+            yield io.TextIOWrapper(response, encoding='utf-8', newline='')
+    else:
+        yield file_path
 
 
 def load_data(file_path):
     try:
-        df = pd.read_csv(file_path)
+        with open_source(file_path) as source:
+            df = pd.read_csv(source, dtype=CSV_DTYPE)
         print("Data loaded successfully.")
         return df
     except Exception as e:
@@ -32,6 +85,16 @@ def load_data(file_path):
         return pd.DataFrame()  # Return an empty DataFrame on failure
 
 
+def load_data_in_chunks(file_path, chunk_size=INGEST_CHUNK_SIZE):
+    """Read the CSV lazily, yielding DataFrames of at most chunk_size rows."""
+    try:
+        with open_source(file_path) as source:
+            for chunk in pd.read_csv(source, chunksize=chunk_size, dtype=CSV_DTYPE):
+                yield chunk
+    except Exception as e:
+        print(f"Error loading data: {e}")
+
+
 def generate_hashed_id(row):
     """Generate a unique hash ID based on the row data."""
     try:
@@ -42,22 +105,19 @@ def generate_hashed_id(row):
         return None
 
 
-def concatenate_columns(row):
-    """Concatenate text columns into a single string."""
-    columns_to_concat = [
-        'cosmetic_link', 'brand_name', 'cosmetic_name', 'num_customer',
-        'price', 'ingredients', 'about', 'reviews', 'recommended'
+def product_fields(row):
+    """Collect the product fields that are chunked and stored for building token-budgeted contexts."""
+    fields_to_store = [
+        'brand_name', 'cosmetic_name', 'price', 'ingredients', 'about', 'reviews', 'recommended'
     ]
-    try:
-        return ' '.join(str(row[col]) for col in columns_to_concat if pd.notnull(row[col]))
-    except KeyError as e:
-        print(f"Missing column for concatenation: {e}")
-        return ''
+    return {col: str(row[col]) for col in fields_to_store if col in row and pd.notnull(row[col])}
 
 
-def create_elasticsearch_index(es_client, index_name):
+def create_elasticsearch_index(es_client, index_name, recreate=True, similarity=VECTOR_SIMILARITY,
+                               hnsw_m=HNSW_M, hnsw_ef_construction=HNSW_EF_CONSTRUCTION,
+                               index_type=VECTOR_INDEX_TYPE):
     """Create index in Elasticsearch with settings for text and vector fields."""
-    if es_client.indices.exists(index=index_name):
+    if recreate and es_client.indices.exists(index=index_name):
         es_client.indices.delete(index=index_name)
         print(f"Index '{index_name}' deleted.")
 
@@ -65,8 +125,23 @@ def create_elasticsearch_index(es_client, index_name):
         "mappings": {
             "properties": {
                 "id": {"type": "keyword"},
+                "parent_id": {"type": "keyword"},
+                "chunk_index": {"type": "integer"},
+                "chunk_field": {"type": "keyword"},
                 "text": {"type": "text"},
-                "embedding": {"type": "dense_vector", "dims": 384}
+                # Stored only, for rag.create_context to pick fields from
+                "fields": {"type": "object", "enabled": False},
+                "embedding": {
+                    "type": "dense_vector",
+                    "dims": 384,
+                    "index": True,
+                    "similarity": similarity,
+                    "index_options": {
+                        "type": index_type,
+                        "m": hnsw_m,
+                        "ef_construction": hnsw_ef_construction
+                    }
+                }
             }
         }
     }
@@ -95,56 +170,289 @@ def generate_embedding(text):
         return [0.0] * 384  # Return zero vector in case of error
 
 
-def transform_data(df):
-    """Transform the DataFrame to include hashed ID, concatenated text, and embedding."""
+def start_embedding_pool(num_workers):
+    """Start a pool of CPU worker processes for embedding, or return None for in-process encoding."""
+    if num_workers <= 1:
+        return None
+    if EMBEDDING_SERVICE_URL:
+        print("Warning: Embeddings come from the embedding service, ignoring the embedding workers.")
+        return None
+    if not supports_multi_process():
+        print("Warning: The ONNX encoder backends encode in process, ignoring the embedding workers.")
+        return None
+    pool = embedding_model.start_multi_process_pool(target_devices=['cpu'] * num_workers)
+    print(f"Started embedding pool with {num_workers} worker processes.")
+    return pool
+
+
+def stop_embedding_pool(pool):
+    """Stop a pool created by start_embedding_pool."""
+    if pool is not None:
+        embedding_model.stop_multi_process_pool(pool)
+
+
+def generate_embeddings_batch(texts, batch_size=EMBEDDING_BATCH_SIZE, pool=None):
+    """Generate vector embeddings for a list of texts in batches, optionally on a worker pool."""
+    texts = list(texts)
+    embeddings = [[0.0] * 384 for _ in texts]  # Zero vectors for rows without text
+    positions = [i for i, text in enumerate(texts) if text]
+    if len(positions) < len(texts):
+        print(f"Warning: {len(texts) - len(positions)} rows have no text for embedding.")
+    if not positions:
+        return embeddings
+
+    start_time = time.time()
     try:
-        df['id'] = df.apply(generate_hashed_id, axis=1)
-        df['text'] = df.apply(concatenate_columns, axis=1)
-        df['embedding'] = df['text'].apply(generate_embedding)
-        return df
+        batch = [texts[i] for i in positions]
+        if pool is not None:
+            vectors = embedding_model.encode_multi_process(batch, pool, batch_size=batch_size)
+        else:
+            vectors = embedding_model.encode(batch, batch_size=batch_size)
+        for i, vector in zip(positions, vectors):
+            embeddings[i] = vector.tolist()
+    except Exception as e:
+        print(f"Error generating embeddings: {e}")
+        return embeddings  # Return zero vectors in case of error
+
+    elapsed = time.time() - start_time
+    docs_per_sec = len(positions) / elapsed if elapsed > 0 else float('inf')
+    print(f"Embedded {len(positions)} documents in {elapsed:.2f}s ({docs_per_sec:.1f} docs/sec).")
+    return embeddings
+
+
+def transform_data(df, batch_size=EMBEDDING_BATCH_SIZE, pool=None):
+    """
+    Split every product row into chunks and embed them in batches.
+    Returns one row per chunk with its id, parent product id (the row hash), text, fields and embedding.
+    """
+    try:
+        chunk_rows = []
+        for _, row in df.iterrows():
+            parent_id = generate_hashed_id(row)
+            if parent_id is None:
+                continue
+            for chunk_index, chunk in enumerate(chunk_product(product_fields(row), chunk_tokenizer)):
+                chunk_rows.append(dict(chunk, id=chunk_id(parent_id, chunk_index), parent_id=parent_id,
+                                       chunk_index=chunk_index))
+        chunks = pd.DataFrame(chunk_rows, columns=['id', 'parent_id', 'chunk_index', 'chunk_field', 'text', 'fields'])
+        print(f"Split {len(df)} products into {len(chunks)} chunks.")
+        chunks['embedding'] = generate_embeddings_batch(chunks['text'], batch_size=batch_size, pool=pool)
+        return chunks
     except Exception as e:
         print(f"Error transforming data: {e}")
         return pd.DataFrame()  # Return an empty DataFrame on failure
 
 
+def generate_actions(df, index_name):
+    """Yield bulk index actions for the chunk rows of a transformed DataFrame."""
+    for chunk in df.itertuples(index=False):
+        if not any(chunk.embedding):
+            # Zero vectors cannot be indexed with the cosine similarity
+            print(f"Warning: Skipping chunk {chunk.id} with an empty embedding.")
+            continue
+        yield {
+            "_index": index_name,
+            "_id": chunk.id,
+            "_source": {
+                "id": chunk.id,
+                "parent_id": chunk.parent_id,
+                "chunk_index": chunk.chunk_index,
+                "chunk_field": chunk.chunk_field,
+                "text": chunk.text,
+                "fields": chunk.fields,
+                "embedding": chunk.embedding
+            }
+        }
+
+
 def load_data_to_elasticsearch(es_client, df, index_name):
     """Load data into Elasticsearch."""
     if df.empty:
         print("No data to load into Elasticsearch.")
         return
-    actions = [
-        {
-            "_index": index_name,
-            "_id": row['id'],
-            "_source": {
-                "id": row['id'],
-                "text": row['text'],
-                "embedding": row['embedding']
-            }
-        }
-        for _, row in df.iterrows() if row['id'] is not None
-    ]
     try:
-        bulk(es_client, actions)
-        print(f"Loaded {len(actions)} documents into Elasticsearch.")
+        loaded, errors = bulk(es_client, generate_actions(df, index_name))
+        print(f"Loaded {loaded} documents into Elasticsearch.")
     except TransportError as e:
         print(f"Error loading data to Elasticsearch: {e}")
 
 
-if __name__ == "__main__":
-    # Define file path and load data
-    file_path = 'https://raw.githubusercontent.com/ovlasenko-ellation/LLM_project3/refs/heads/main/Data/Sephora_all.csv'
-    df = load_data(file_path)
+def stream_data_to_elasticsearch(es_client, file_path, index_name, chunk_size=INGEST_CHUNK_SIZE,
+                                 bulk_chunk_size=BULK_CHUNK_SIZE, thread_count=BULK_THREAD_COUNT,
+                                 batch_size=EMBEDDING_BATCH_SIZE, pool=None):
+    """
+    Stream the CSV into Elasticsearch chunk by chunk, so that only one chunk of rows and
+    a bounded number of bulk requests are held in memory at any time.
+    """
+    def actions():
+        for chunk in load_data_in_chunks(file_path, chunk_size):
+            transformed_chunk = transform_data(chunk, batch_size=batch_size, pool=pool)
+            if transformed_chunk.empty:
+                continue
+            yield from generate_actions(transformed_chunk, index_name)
 
-    # Ensure data loaded successfully before continuing
-    if not df.empty:
-        # Transform data
-        transformed_df = transform_data(df)
+    return run_bulk(es_client, actions(), bulk_chunk_size=bulk_chunk_size, thread_count=thread_count)
 
-        # Set up Elasticsearch index
-        create_elasticsearch_index(es, index_name)
 
-        # Load transformed data to Elasticsearch
-        load_data_to_elasticsearch(es, transformed_df, index_name)
+def run_bulk(es_client, actions, bulk_chunk_size=BULK_CHUNK_SIZE, thread_count=BULK_THREAD_COUNT):
+    """Send a stream of bulk actions to Elasticsearch and report the number of successful documents."""
+    if thread_count > 1:
+        results = parallel_bulk(es_client, actions, thread_count=thread_count,
+                                chunk_size=bulk_chunk_size, queue_size=thread_count,
+                                raise_on_error=False)
     else:
-        print("Data loading failed, exiting script.")
+        results = streaming_bulk(es_client, actions, chunk_size=bulk_chunk_size,
+                                 raise_on_error=False)
+
+    start_time = time.time()
+    loaded, failed = 0, 0
+    try:
+        for ok, info in results:
+            if ok:
+                loaded += 1
+            else:
+                failed += 1
+                print(f"Error loading document to Elasticsearch: {info}")
+    except TransportError as e:
+        print(f"Error loading data to Elasticsearch: {e}")
+
+    elapsed = time.time() - start_time
+    docs_per_sec = loaded / elapsed if elapsed > 0 else float('inf')
+    print(f"Loaded {loaded} documents into Elasticsearch ({failed} failed) "
+          f"in {elapsed:.2f}s ({docs_per_sec:.1f} docs/sec).")
+    return loaded, failed
+
+
+def fetch_indexed_ids(es_client, index_name):
+    """
+    Return the document ids currently stored in the index, grouped by product id (row hash).
+    Documents indexed before chunking are their own product.
+    """
+    if not es_client.indices.exists(index=index_name):
+        return {}
+    query = {"query": {"match_all": {}}, "_source": ["parent_id"]}
+    indexed_ids = {}
+    for hit in scan(es_client, index=index_name, query=query):
+        indexed_ids.setdefault(parent_id_of(hit), []).append(hit['_id'])
+    return indexed_ids
+
+
+def incremental_update_elasticsearch(es_client, file_path, index_name, chunk_size=INGEST_CHUNK_SIZE,
+                                     bulk_chunk_size=BULK_CHUNK_SIZE, thread_count=BULK_THREAD_COUNT,
+                                     batch_size=EMBEDDING_BATCH_SIZE, pool=None):
+    """
+    Bring the index in line with the CSV by comparing row hashes with the ids already indexed.
+    Only new or changed rows are embedded and indexed, and rows that disappeared from the
+    CSV are deleted. A changed row gets a new hash, so it is indexed as new chunks and
+    the chunks of its previous version are deleted as stale.
+    """
+    create_elasticsearch_index(es_client, index_name, recreate=False)
+    indexed_ids = fetch_indexed_ids(es_client, index_name)
+    indexed_parent_ids = set(indexed_ids)
+    print(f"Found {len(indexed_parent_ids)} products already in '{index_name}'.")
+
+    seen_ids = set()
+    read_state = {'completed': False}
+
+    def actions():
+        try:
+            with open_source(file_path) as source:
+                for chunk in pd.read_csv(source, chunksize=chunk_size, dtype=CSV_DTYPE):
+                    row_ids = chunk.apply(generate_hashed_id, axis=1)
+                    seen_ids.update(row_ids.dropna())
+                    changed_rows = chunk[row_ids.notna() & ~row_ids.isin(indexed_parent_ids)]
+                    if changed_rows.empty:
+                        continue
+                    transformed_chunk = transform_data(changed_rows.copy(), batch_size=batch_size, pool=pool)
+                    if transformed_chunk.empty:
+                        continue
+                    yield from generate_actions(transformed_chunk, index_name)
+            read_state['completed'] = True
+        except Exception as e:
+            print(f"Error loading data: {e}")
+
+    upserted, failed = run_bulk(es_client, actions(), bulk_chunk_size=bulk_chunk_size,
+                                thread_count=thread_count)
+
+    # Without a complete pass over the CSV we cannot tell which documents are gone
+    if not read_state['completed']:
+        print("CSV was not read completely, skipping deletion of stale documents.")
+        return upserted, 0, failed
+
+    stale_ids = indexed_parent_ids - seen_ids
+    delete_actions = (
+        {"_op_type": "delete", "_index": index_name, "_id": doc_id}
+        for parent_id in stale_ids
+        for doc_id in indexed_ids[parent_id]
+    )
+    deleted, delete_failed = run_bulk(es_client, delete_actions, bulk_chunk_size=bulk_chunk_size,
+                                      thread_count=thread_count)
+    print(f"Incremental update: {upserted} chunks upserted, {deleted} stale chunks deleted, "
+          f"{len(seen_ids & indexed_parent_ids)} products unchanged.")
+    return upserted, deleted, failed + delete_failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the Sephora catalog into Elasticsearch.")
+    parser.add_argument('--source', default=CATALOG_SOURCE,
+                        help="Catalog CSV: a local path or an http(s) URL, streamed in stream and incremental mode.")
+    parser.add_argument('--mode', choices=['full', 'stream', 'incremental'], default='full',
+                        help="'full' loads the whole CSV in memory, 'stream' processes it chunk by chunk, "
+                             "'incremental' only indexes new or changed rows and deletes removed ones.")
+    parser.add_argument('--batch-size', type=int, default=EMBEDDING_BATCH_SIZE,
+                        help="Number of texts encoded per embedding batch.")
+    parser.add_argument('--workers', type=int, default=EMBEDDING_WORKERS,
+                        help="Number of CPU worker processes used for embedding.")
+    parser.add_argument('--chunk-size', type=int, default=INGEST_CHUNK_SIZE,
+                        help="Number of CSV rows read and embedded per chunk in stream and incremental mode.")
+    parser.add_argument('--bulk-chunk-size', type=int, default=BULK_CHUNK_SIZE,
+                        help="Number of documents sent per bulk request in stream and incremental mode.")
+    parser.add_argument('--threads', type=int, default=BULK_THREAD_COUNT,
+                        help="Number of threads sending bulk requests in stream and incremental mode.")
+    parser.add_argument('--index-type', choices=VECTOR_INDEX_TYPES, default=VECTOR_INDEX_TYPE,
+                        help="Vector index type; the quantized types apply when the index is (re)created.")
+    parser.add_argument('--snapshot', default=None,
+                        help="Directory to export a memory-mapped embedding snapshot to after loading.")
+    parser.add_argument('--snapshot-dtype', choices=SNAPSHOT_DTYPES, default='float16',
+                        help="Storage type of the snapshot vectors.")
+    args = parser.parse_args()
+
+    file_path = args.source
+
+    pool = start_embedding_pool(args.workers)
+    try:
+        if args.mode == 'stream':
+            # Set up Elasticsearch index and stream the CSV into it chunk by chunk
+            create_elasticsearch_index(es, index_name, index_type=args.index_type)
+            stream_data_to_elasticsearch(es, file_path, index_name, chunk_size=args.chunk_size,
+                                         bulk_chunk_size=args.bulk_chunk_size, thread_count=args.threads,
+                                         batch_size=args.batch_size, pool=pool)
+        elif args.mode == 'incremental':
+            # Keep the existing index and apply only the difference with the CSV
+            incremental_update_elasticsearch(es, file_path, index_name, chunk_size=args.chunk_size,
+                                             bulk_chunk_size=args.bulk_chunk_size, thread_count=args.threads,
+                                             batch_size=args.batch_size, pool=pool)
+        else:
+            df = load_data(file_path)
+
+            # Ensure data loaded successfully before continuing
+            if not df.empty:
+                # Transform data
+                transformed_df = transform_data(df, batch_size=args.batch_size, pool=pool)
+
+                # Set up Elasticsearch index
+                create_elasticsearch_index(es, index_name, index_type=args.index_type)
+
+                # Load transformed data to Elasticsearch
+                load_data_to_elasticsearch(es, transformed_df, index_name)
+            else:
+                print("Data loading failed, exiting script.")
+    finally:
+        stop_embedding_pool(pool)
+
+    # Let running apps know that answers built on the previous catalog are stale
+    bump_catalog_version(es, index_name)
+
+    if args.snapshot:
+        count = export_snapshot_from_elasticsearch(es, index_name, args.snapshot, dtype=args.snapshot_dtype)
+        print(f"Exported {count} documents to snapshot {args.snapshot}.")
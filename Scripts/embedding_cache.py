@@ -0,0 +1,123 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_text(text):
+    """
+    Normalises text for use as a cache key: lower case with collapsed whitespace.
+    The MiniLM tokenizer is uncased, so this does not change the embedding.
+    """
+    return ' '.join(str(text).lower().split())
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of text embeddings keyed on normalised text.
+    The memory tier is a bounded LRU; the optional disk tier is a SQLite file that
+    survives restarts and can be shared by several processes.
+    """
+
+    def __init__(self, max_size=1024, persist_path=None, namespace='all-MiniLM-L6-v2'):
+        self.max_size = max_size
+        self.namespace = namespace
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.compute_time = 0.0
+
+        self.db = None
+        if persist_path:
+            directory = os.path.dirname(persist_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(persist_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self.db.commit()
+
+    def make_key(self, text):
+        return f"{self.namespace}:{normalize_text(text)}"
+
+    def get(self, text):
+        """
+        Returns the cached embedding for the text, or None.
+        """
+        key = self.make_key(text)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return self.entries[key]
+            if self.db is not None:
+                row = self.db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, text, embedding):
+        """
+        Stores the embedding in both tiers.
+        """
+        key = self.make_key(text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            self._remember(key, vector)
+            if self.db is not None:
+                try:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        (key, vector.tobytes())
+                    )
+                    self.db.commit()
+                except sqlite3.Error as e:
+                    logging.error(f"Error persisting embedding to the cache: {e}")
+
+    def get_or_compute(self, text, compute):
+        """
+        Returns the cached embedding, or computes it with compute(text) and caches it.
+        """
+        vector = self.get(text)
+        if vector is not None:
+            return vector
+        start_time = time.time()
+        vector = compute(text)
+        elapsed = time.time() - start_time
+        with self.lock:
+            self.compute_time += elapsed
+        self.put(text, vector)
+        return np.asarray(vector, dtype=np.float32)
+
+    def _remember(self, key, vector):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and an estimate of the encode time saved by hits.
+        """
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            avg_compute_time = self.compute_time / self.misses if self.misses else 0.0
+            lookups = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'size': len(self.entries),
+                'saved_seconds': hits * avg_compute_time
+            }
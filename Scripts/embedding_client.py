@@ -0,0 +1,77 @@
+import http.client
+import json
+import threading
+from urllib.parse import urlsplit
+import numpy as np
+from embedding_server import EMBEDDING_MAX_BATCH_SIZE
+
+
+class EmbeddingServiceClient:
+    """
+    Client of embedding_server.py with the encode() interface of SentenceTransformer, so it can stand in
+    for the model in rag.py, evaluation.py and ingestion. Each thread keeps its own keep-alive connection.
+    """
+
+    def __init__(self, url, timeout=30.0, request_size=EMBEDDING_MAX_BATCH_SIZE):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.request_size = request_size  # Most texts sent per request, at most the batch size of the service
+        self.dimension = None
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return connection
+
+    def post(self, texts):
+        body = json.dumps({'texts': texts})
+        for attempt in range(2):
+            connection = self.connection()
+            try:
+                connection.request('POST', '/embed', body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                payload = json.loads(response.read())
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The service closed the idle connection: reconnect once
+                connection.close()
+                self.local.connection = None
+                if attempt == 1:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"Embedding service error {response.status}: {payload.get('error')}")
+        return payload['embeddings']
+
+    def get_sentence_embedding_dimension(self):
+        if self.dimension is None:
+            connection = self.connection()
+            connection.request('GET', '/health')
+            self.dimension = json.loads(connection.getresponse().read())['dimension']
+        return self.dimension
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        """
+        Returns the embedding of one text as a 1-D array, or of a list of texts as a 2-D array.
+        Other SentenceTransformer.encode options are ignored.
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        embeddings = []
+        for start in range(0, len(texts), self.request_size):
+            embeddings.extend(self.post(texts[start:start + self.request_size]))
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        return vectors[0] if single else vectors
+
+    def stats(self):
+        """
+        Returns the batch size, queue wait and encode time histograms of the service.
+        """
+        connection = self.connection()
+        connection.request('GET', '/stats')
+        return json.loads(connection.getresponse().read())
@@ -0,0 +1,244 @@
+import argparse
+import bisect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Embedding service: one process holds the model and encodes the texts of concurrent requests together.
+# A request waits at most EMBEDDING_MAX_WAIT_MS for others to join its batch, and a batch holds at most
+# EMBEDDING_MAX_BATCH_SIZE texts; larger requests are split into slices of that size. Clients (embedding_client.py) are used by rag.py, evaluation.py and
+# ingestion when EMBEDDING_SERVICE_URL points at the service. GET /stats returns histograms of the batch
+# sizes, queue waits and encode times.
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '64'))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv('EMBEDDING_MAX_WAIT_MS', '5'))
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+MILLISECOND_BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000]
+
+
+class Histogram:
+    """
+    Thread-safe histogram with fixed upper bucket bounds, like a Prometheus histogram.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket counts values above every bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def snapshot(self):
+        with self.lock:
+            labels = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+            return {
+                'buckets': dict(zip(labels, self.counts)),
+                'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'max': self.max
+            }
+
+
+class MicroBatcher:
+    """
+    Collects the texts of concurrent encode requests into batches for a single worker thread.
+    """
+
+    def __init__(self, encode, max_batch_size=EMBEDDING_MAX_BATCH_SIZE, max_wait_ms=EMBEDDING_MAX_WAIT_MS):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.pending = None  # Request that did not fit into the previous batch
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(MILLISECOND_BUCKETS)
+        self.encode_ms = Histogram(MILLISECOND_BUCKETS)
+        self.worker = threading.Thread(target=self.run, name='embedding-batcher', daemon=True)
+        self.worker.start()
+
+    def submit(self, texts):
+        """
+        Queues texts for encoding and returns a Future of their embeddings (an array of one row per text).
+        Texts beyond the batch size are queued as separate slices, so other requests can be batched in between.
+        """
+        future = Future()
+        slices = [texts[start:start + self.max_batch_size] for start in range(0, len(texts), self.max_batch_size)]
+        if len(slices) <= 1:
+            self.requests.put((texts, future, time.perf_counter()))
+            return future
+        parts = [Future() for _ in slices]
+        remaining = [len(parts)]
+        lock = threading.Lock()
+
+        def collect(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                future.set_result(np.concatenate([part.result() for part in parts]))
+            except Exception as e:
+                future.set_exception(e)
+
+        queued_at = time.perf_counter()
+        for request_texts, part in zip(slices, parts):
+            self.requests.put((request_texts, part, queued_at))
+        for part in parts:
+            part.add_done_callback(collect)
+        return future
+
+    def next_batch(self):
+        """
+        Blocks for the first request, then adds requests arriving within the wait window up to the batch size.
+        A request that would overflow the batch starts the next one.
+        """
+        if self.pending is not None:
+            batch, self.pending = [self.pending], None
+        else:
+            batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                self.pending = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            started = time.perf_counter()
+            texts = [text for request_texts, _, _ in batch for text in request_texts]
+            for _, _, queued_at in batch:
+                self.queue_wait_ms.observe((started - queued_at) * 1000)
+            self.batch_sizes.observe(len(texts))
+            try:
+                embeddings = np.asarray(self.encode(texts, batch_size=max(len(texts), 1)))
+            except Exception as e:
+                logging.error(f"Error encoding a batch of {len(texts)} texts: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            self.encode_ms.observe((time.perf_counter() - started) * 1000)
+            offset = 0
+            for request_texts, future, _ in batch:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+    def stats(self):
+        return {
+            'queued_requests': self.requests.qsize() + (self.pending is not None),
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_wait_ms': self.queue_wait_ms.snapshot(),
+            'encode_ms': self.encode_ms.snapshot()
+        }
+
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    server_version = 'EmbeddingService/1.0'
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so clients reuse their connection
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'model': self.server.model_name, 'dimension': self.server.dimension})
+        elif self.path == '/stats':
+            self.send_json(200, self.server.batcher.stats())
+        else:
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        # Read the whole body first, so the connection stays usable after an error response
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/embed':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            request = json.loads(body or b'{}')
+            texts = request['texts']
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError("'texts' must be a list of strings")
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {'error': f'Invalid request: {e}'})
+            return
+        try:
+            embeddings = self.server.batcher.submit(texts).result() if texts else np.zeros((0, self.server.dimension))
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'model': self.server.model_name, 'embeddings': embeddings.tolist()})
+
+
+def start_server(model, model_name, host='127.0.0.1', port=8002, max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+                 max_wait_ms=EMBEDDING_MAX_WAIT_MS):
+    """
+    Starts the service for a loaded model in a background thread and returns the server;
+    stop it with server.shutdown(). Use port 0 to pick a free port (server.server_address[1]).
+    """
+    server = ThreadingHTTPServer((host, port), EmbeddingHandler)
+    server.daemon_threads = True
+    server.model_name = model_name
+    server.dimension = len(model.encode(''))  # Also warms up the model before the first request
+    server.batcher = MicroBatcher(model.encode, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    threading.Thread(target=server.serve_forever, name='embedding-server', daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    from encoder import ENCODER_BACKENDS, ENCODER_BACKEND, load_encoder
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve sentence embeddings over HTTP with dynamic micro-batching.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--backend', choices=ENCODER_BACKENDS, default=ENCODER_BACKEND)
+    parser.add_argument('--max-batch-size', type=int, default=EMBEDDING_MAX_BATCH_SIZE, help="Most texts per batch.")
+    parser.add_argument('--max-wait-ms', type=float, default=EMBEDDING_MAX_WAIT_MS,
+                        help="Longest time a request waits for others to join its batch.")
+    parser.add_argument('--stats-interval', type=float, default=60.0, help="Seconds between stats logs (0 = off).")
+    args = parser.parse_args()
+
+    service = start_server(load_encoder(args.model, args.backend), args.model, args.host, args.port,
+                           args.max_batch_size, args.max_wait_ms)
+    print(f"Embedding service listening on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(args.stats_interval or 3600)
+            if args.stats_interval:
+                logging.info(f"Embedding service stats: {json.dumps(service.batcher.stats())}")
+    except KeyboardInterrupt:
+        service.shutdown()
@@ -0,0 +1,223 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import scan
+from chunking import parent_id_of
+
+# On-disk layout of a snapshot directory:
+#   meta.json         count, dims, dtype and model of the snapshot
+#   vectors.bin       (count, dims) L2-normalised vectors stored as float16 or int8
+#   scales.bin        (count,) float32 per-row scales, only for int8 vectors
+#   ids.bin / texts.bin / parent_ids.bin                 UTF-8 blobs with all ids / texts / product ids concatenated
+#   id_offsets.bin / text_offsets.bin / parent_offsets.bin    (count + 1,) int64 offsets into the blobs
+# Snapshots written before parent_ids.bin was added have no product ids; their chunk ids still carry them.
+SNAPSHOT_DTYPES = ('float16', 'int8')
+
+
+def open_memmap(path, dtype, shape):
+    """
+    Opens a read-only memory map, or an empty array for an empty file.
+    """
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class StringBlob:
+    """
+    Read-only sequence of strings stored as one UTF-8 blob with an offsets array.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return bytes(self.blob[start:end]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class SnapshotWriter:
+    """
+    Appends ids, texts, product ids and embeddings to a new snapshot in batches.
+    Files are written to a temporary directory that replaces the target on close,
+    so readers never see a half-written snapshot.
+    """
+
+    def __init__(self, path, dtype='float16', model_name='all-MiniLM-L6-v2'):
+        if dtype not in SNAPSHOT_DTYPES:
+            raise ValueError(f"Unsupported snapshot dtype: {dtype}")
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.dtype = dtype
+        self.model_name = model_name
+        self.count = 0
+        self.dims = None
+        self.id_offset = 0
+        self.text_offset = 0
+        self.parent_offset = 0
+
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.files = {
+            name: open(os.path.join(self.tmp_path, f"{name}.bin"), 'wb')
+            for name in ('vectors', 'scales', 'ids', 'texts', 'parent_ids', 'id_offsets', 'text_offsets',
+                         'parent_offsets')
+        }
+        for name in ('id_offsets', 'text_offsets', 'parent_offsets'):
+            np.zeros(1, dtype=np.int64).tofile(self.files[name])
+
+    def add(self, ids, texts, embeddings, parent_ids=None):
+        """
+        Appends a batch of documents to the snapshot; without parent_ids every document is its own product.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        if self.dims is None:
+            self.dims = vectors.shape[1]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+
+        if self.dtype == 'int8':
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            quantized.tofile(self.files['vectors'])
+            scales.astype(np.float32).tofile(self.files['scales'])
+        else:
+            vectors.astype(np.float16).tofile(self.files['vectors'])
+
+        self.id_offset = self._append_strings(ids, 'ids', 'id_offsets', self.id_offset)
+        self.text_offset = self._append_strings(texts, 'texts', 'text_offsets', self.text_offset)
+        self.parent_offset = self._append_strings(ids if parent_ids is None else parent_ids, 'parent_ids',
+                                                  'parent_offsets', self.parent_offset)
+        self.count += len(vectors)
+
+    def _append_strings(self, values, blob_name, offsets_name, offset):
+        offsets = []
+        for value in values:
+            encoded = str(value).encode('utf-8')
+            self.files[blob_name].write(encoded)
+            offset += len(encoded)
+            offsets.append(offset)
+        np.asarray(offsets, dtype=np.int64).tofile(self.files[offsets_name])
+        return offset
+
+    def close(self):
+        """
+        Writes the metadata and moves the finished snapshot into place.
+        """
+        for f in self.files.values():
+            f.close()
+        meta = {
+            "count": self.count,
+            "dims": self.dims or 384,
+            "dtype": self.dtype,
+            "normalized": True,
+            "model_name": self.model_name,
+            "created_at": time.time()
+        }
+        with open(os.path.join(self.tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+        logging.info(f"Wrote snapshot with {self.count} documents to {self.path}.")
+
+
+class EmbeddingSnapshot:
+    """
+    Read-only view of a snapshot. Vectors, ids and texts are memory-mapped, so all
+    processes opening the same snapshot share one copy through the page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        count, dims = self.meta['count'], self.meta['dims']
+        self.dtype = self.meta['dtype']
+
+        self.vectors = open_memmap(os.path.join(path, 'vectors.bin'), self.dtype, (count, dims))
+        self.scales = None
+        if self.dtype == 'int8':
+            self.scales = open_memmap(os.path.join(path, 'scales.bin'), np.float32, (count,))
+
+        id_offsets = open_memmap(os.path.join(path, 'id_offsets.bin'), np.int64, (count + 1,))
+        text_offsets = open_memmap(os.path.join(path, 'text_offsets.bin'), np.int64, (count + 1,))
+        self.ids = StringBlob(open_memmap(os.path.join(path, 'ids.bin'), np.uint8, (int(id_offsets[-1]),)), id_offsets)
+        self.texts = StringBlob(open_memmap(os.path.join(path, 'texts.bin'), np.uint8, (int(text_offsets[-1]),)), text_offsets)
+        self.parent_ids = None
+        if os.path.exists(os.path.join(path, 'parent_offsets.bin')):
+            parent_offsets = open_memmap(os.path.join(path, 'parent_offsets.bin'), np.int64, (count + 1,))
+            self.parent_ids = StringBlob(open_memmap(os.path.join(path, 'parent_ids.bin'), np.uint8,
+                                                    (int(parent_offsets[-1]),)), parent_offsets)
+
+    def __len__(self):
+        return self.meta['count']
+
+    def embedding(self, i):
+        """
+        Returns the (normalised) float32 embedding of document i.
+        """
+        vector = np.asarray(self.vectors[i], dtype=np.float32)
+        if self.scales is not None:
+            vector = vector * self.scales[i]
+        return vector
+
+
+def write_snapshot(path, ids, texts, embeddings, dtype='float16', parent_ids=None):
+    """
+    Writes in-memory ids, texts, product ids and embeddings to a snapshot.
+    """
+    writer = SnapshotWriter(path, dtype=dtype)
+    writer.add(ids, texts, embeddings, parent_ids)
+    writer.close()
+
+
+def export_snapshot_from_elasticsearch(es_client, index_name, path, dtype='float16', batch_size=1000):
+    """
+    Scrolls over the index and writes every document to a snapshot, batch by batch.
+    """
+    es_client.indices.refresh(index=index_name)
+    writer = SnapshotWriter(path, dtype=dtype)
+    ids, texts, parent_ids, embeddings = [], [], [], []
+    query = {"query": {"match_all": {}}, "_source": ["id", "text", "parent_id", "embedding"]}
+    for hit in scan(es_client, index=index_name, query=query, size=batch_size):
+        ids.append(hit['_id'])
+        texts.append(hit['_source'].get('text', ''))
+        parent_ids.append(parent_id_of(hit))
+        embeddings.append(hit['_source']['embedding'])
+        if len(ids) >= batch_size:
+            writer.add(ids, texts, embeddings, parent_ids)
+            ids, texts, parent_ids, embeddings = [], [], [], []
+    writer.add(ids, texts, embeddings, parent_ids)
+    writer.close()
+    return writer.count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export the embeddings of an index to a memory-mapped snapshot.")
+    parser.add_argument('--index', default='cosmetics_index', help="Elasticsearch index to export.")
+    parser.add_argument('--output', default='./Data/embedding_snapshot', help="Snapshot directory.")
+    parser.add_argument('--dtype', choices=SNAPSHOT_DTYPES, default='float16', help="Storage type of the vectors.")
+    args = parser.parse_args()
+
+    ES_HOST = os.getenv('ES_HOST', 'localhost')
+    es = Elasticsearch([f'http://{ES_HOST}:9200'])
+    count = export_snapshot_from_elasticsearch(es, args.index, args.output, dtype=args.dtype)
+    print(f"Exported {count} documents to {args.output}.")
@@ -0,0 +1,61 @@
+import logging
+import os
+import platform
+import time
+from sentence_transformers import SentenceTransformer
+
+# Inference backend of the embedding model:
+# 'torch' runs the model in eager PyTorch, 'torch-qint8' with its Linear layers dynamically quantized to int8,
+# 'onnx' runs the exported ONNX graph in onnxruntime and 'onnx-qint8' the int8 quantized ONNX graph.
+# The ONNX backends need `pip install "sentence-transformers[onnx]"`.
+ENCODER_BACKENDS = ['torch', 'torch-qint8', 'onnx', 'onnx-qint8']
+ENCODER_BACKEND = os.getenv('ENCODER_BACKEND', 'torch')
+# Quantized ONNX files shipped with the model, one per CPU instruction set; the avx2 one is quantized to unsigned int8
+ONNX_QUANTIZED_FILES = {
+    'arm64': 'onnx/model_qint8_arm64.onnx',
+    'avx2': 'onnx/model_quint8_avx2.onnx',
+    'avx512': 'onnx/model_qint8_avx512.onnx',
+    'avx512_vnni': 'onnx/model_qint8_avx512_vnni.onnx',
+}
+ONNX_QUANTIZATION = os.getenv('ONNX_QUANTIZATION', 'arm64' if platform.machine() in ('arm64', 'aarch64') else 'avx2')
+
+# Lowest cosine similarity to the 'torch' embedding of the same text that a backend may produce,
+# so its question embeddings can be searched against an index built with another backend
+ENCODER_MIN_COSINE = {
+    'torch': 0.9999,
+    'onnx': 0.9999,
+    'torch-qint8': 0.98,
+    'onnx-qint8': 0.98,
+}
+
+
+def load_encoder(model_name='all-MiniLM-L6-v2', backend=ENCODER_BACKEND):
+    """
+    Loads the SentenceTransformer model for the given inference backend.
+    Every backend returns the same encode() interface and normalised embeddings of the same size.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend}")
+    if backend == 'onnx-qint8' and ONNX_QUANTIZATION not in ONNX_QUANTIZED_FILES:
+        raise ValueError(f"Unknown ONNX quantization: {ONNX_QUANTIZATION}")
+    start_time = time.time()
+    if backend == 'torch':
+        model = SentenceTransformer(model_name)
+    elif backend == 'torch-qint8':
+        import torch
+        model = SentenceTransformer(model_name, device='cpu')  # Dynamic quantization runs on CPU only
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend == 'onnx':
+        model = SentenceTransformer(model_name, backend='onnx')
+    else:
+        model = SentenceTransformer(model_name, backend='onnx',
+                                    model_kwargs={'file_name': ONNX_QUANTIZED_FILES[ONNX_QUANTIZATION]})
+    logging.info(f"Loaded {model_name} with the {backend} backend in {time.time() - start_time:.2f}s.")
+    return model
+
+
+def supports_multi_process(backend=ENCODER_BACKEND):
+    """
+    ONNX sessions cannot be sent to worker processes, so only the PyTorch backends can encode in a process pool.
+    """
+    return backend.startswith('torch')
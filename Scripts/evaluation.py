@@ -1,22 +1,38 @@
 import pandas as pd
 import numpy as np
-from openai import OpenAI
 from sklearn.metrics.pairwise import cosine_similarity
 from rag import (
     get_user_question,
-    search_es,
+    search_documents,
+    get_index_stats,
+    RETRIEVAL_BACKEND,
     create_context,
     build_prompt,
     llm
 )  # Import functions directly from rag.py
 import os
+import re
+import json
+import time
 import logging
-from sentence_transformers import SentenceTransformer
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from resources import get_embedding_model
+from rate_limiter import RateLimiter
 
-# Set up OpenAI API key
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-model_name = 'all-MiniLM-L6-v2'  # or any other compatible model
-embedding_model = SentenceTransformer(model_name)
+# Evaluation runner settings: concurrent LLM calls under OpenAI-style rate limits, batched encoding
+# and a JSONL checkpoint of finished answers so an interrupted run resumes where it stopped
+EVAL_CONCURRENCY = int(os.getenv('EVAL_CONCURRENCY', '8'))
+EVAL_REQUESTS_PER_MINUTE = int(os.getenv('EVAL_REQUESTS_PER_MINUTE', '500'))
+EVAL_TOKENS_PER_MINUTE = int(os.getenv('EVAL_TOKENS_PER_MINUTE', '200000'))
+EVAL_COMPLETION_TOKENS = int(os.getenv('EVAL_COMPLETION_TOKENS', '300'))  # Expected answer length for the estimate
+EVAL_ENCODE_BATCH_SIZE = int(os.getenv('EVAL_ENCODE_BATCH_SIZE', '256'))
+EVAL_CHECKPOINT_PATH = os.getenv('EVAL_CHECKPOINT_PATH', './Data/evaluation_checkpoint.jsonl')
+# A retrieved product is the source of a ground truth row when its id equals the row's product_id or,
+# for ground truth without that column (like the published ground_truth.csv), when its product name
+# occurs in the question or answer. Name matching credits every product of the same name and misses
+# products the question does not name, so only product_id results measure source-product retrieval.
+EVAL_MATCHING_MODES = ['product_id', 'product_name']
 
 def load_ground_truth_data(url, num_rows=1000):
     """
@@ -34,6 +50,16 @@ def compute_cosine_similarity(v1, v2):
     return cosine_similarity(v1, v2)[0][0]
 
 
+def row_cosine_similarity(a, b):
+    """
+    Compute the cosine similarity of every row of a with the same row of b.
+    """
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    norms[norms == 0] = 1.0  # Zero vectors get a similarity of 0
+    return np.einsum('ij,ij->i', a, b) / norms
+
+
 def hit_rate(relevance_total):
     """
     Calculate the Hit Rate given relevance data.
@@ -58,48 +84,121 @@ def mrr(relevance_total):
     return total_score / len(relevance_total) if relevance_total else 0
 
 
-def evaluate_llm_against_ground_truth(df):
+def estimate_tokens(prompt):
     """
-    Evaluate the LLM against ground truth data based on a single user question.
+    Rough token estimate of a request for the rate limiter: about 4 characters per prompt token
+    plus the expected answer length.
     """
+    return len(prompt) // 4 + EVAL_COMPLETION_TOKENS
 
-    v_llm = []
-    v_orig = []
-    relevance_total = []
-    cosine_similarities = []
 
-    for idx, row in df.iterrows():
-        question = row['question']
-        question_embedding = embedding_model.encode(question).tolist()
-        logging.info(f"Generated embedding for the question : {question_embedding}")
+def generate_llm_answer(question, question_embedding, limiter):
+    """
+    Retrieves the context for a question and asks the LLM, waiting for the rate limiter first.
+    """
+    hits = search_documents(question_embedding)
+    context = create_context(hits)
+    prompt = build_prompt(question, context)
 
-        # Elasticsearch retrieval and context creation based on the single question embedding
-        hits = search_es(question_embedding)
-        context = create_context(hits)
+    estimated_tokens = estimate_tokens(prompt)
+    limiter.acquire(estimated_tokens)
+    result = llm(prompt)
+    if not isinstance(result, tuple):
+        # llm returns only an error message when the API call fails
+        limiter.record_usage(estimated_tokens, 0)
+        raise RuntimeError(result)
+    answer, _, total_tokens, _ = result
+    limiter.record_usage(estimated_tokens, total_tokens)
+    return answer
 
-        # Construct the prompt using the retrieved context and the actual user question
-        prompt = build_prompt(question, context)
-        llm_answer = llm(prompt)[0]  # Call LLM to get an answer based on the single question
 
-        # Embedding for LLM answer, which will be compared to each ground truth answer
-        v_llm_embedding = embedding_model.encode(llm_answer).tolist()
+def load_checkpoint(checkpoint_path, df):
+    """
+    Returns {row index: LLM answer} of the rows answered by a previous run of the same data.
+    """
+    answers = {}
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return answers
+    with open(checkpoint_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Line cut off by a crash
+            idx = record['index']
+            if idx in df.index and df.at[idx, 'question'] == record['question']:
+                answers[idx] = record['llm_answer']
+    logging.info(f"Resuming with {len(answers)} answers from {checkpoint_path}.")
+    return answers
 
-        ground_truth_answer = row['answer']
 
-        # Generate embedding for the ground truth answer
-        v_orig_embedding = embedding_model.encode(ground_truth_answer).tolist()
+def collect_llm_answers(df, checkpoint_path=EVAL_CHECKPOINT_PATH, concurrency=EVAL_CONCURRENCY,
+                        requests_per_minute=EVAL_REQUESTS_PER_MINUTE, tokens_per_minute=EVAL_TOKENS_PER_MINUTE):
+    """
+    Generates the LLM answers of every ground truth question concurrently, appending each answer
+    to the checkpoint as soon as it arrives. Questions answered in the checkpoint are skipped.
+    Returns {row index: LLM answer}; failed rows are missing and retried by the next run.
+    """
+    answers = load_checkpoint(checkpoint_path, df)
+    pending = df[~df.index.isin(list(answers))]
+    if pending.empty:
+        return answers
 
-        # Store answers for similarity comparisons
-        v_llm.append(llm_answer)
-        v_orig.append(ground_truth_answer)
+    questions = pending['question'].tolist()
+    question_embeddings = get_embedding_model().encode(questions, batch_size=EVAL_ENCODE_BATCH_SIZE)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
 
-        # Calculate cosine similarity between LLM and ground truth answer
-        similarity_score = compute_cosine_similarity(v_llm_embedding, v_orig_embedding)
-        cosine_similarities.append(similarity_score)
+    if checkpoint_path and os.path.dirname(checkpoint_path):
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    checkpoint = open(checkpoint_path, 'a') if checkpoint_path else None
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(generate_llm_answer, question, embedding.tolist(), limiter): (idx, question)
+                for idx, question, embedding in zip(pending.index, questions, question_embeddings)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                idx, question = futures[future]
+                try:
+                    answers[idx] = future.result()
+                except Exception as e:
+                    logging.error(f"Error answering question {idx}: {e}")
+                    continue
+                if checkpoint is not None:
+                    record = {'index': int(idx), 'question': question, 'llm_answer': answers[idx]}
+                    checkpoint.write(json.dumps(record) + '\n')
+                    checkpoint.flush()
+                if done % 50 == 0:
+                    logging.info(f"Answered {done}/{len(futures)} questions.")
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    return answers
 
-        # Determine relevance (similarity > threshold implies relevance)
-        is_relevant = similarity_score > 0.5  # Define a relevance threshold
-        relevance_total.append([is_relevant])
+
+def evaluate_llm_against_ground_truth(df, checkpoint_path=EVAL_CHECKPOINT_PATH, concurrency=EVAL_CONCURRENCY,
+                                      requests_per_minute=EVAL_REQUESTS_PER_MINUTE,
+                                      tokens_per_minute=EVAL_TOKENS_PER_MINUTE):
+    """
+    Evaluate the LLM against ground truth data.
+    LLM answers are generated concurrently, then all answers are encoded in batches and compared
+    with the ground truth answers in one vectorized step.
+    """
+    answers = collect_llm_answers(df, checkpoint_path, concurrency, requests_per_minute, tokens_per_minute)
+    answered = df[df.index.isin(list(answers))]
+    if len(answered) < len(df):
+        logging.warning(f"{len(df) - len(answered)} questions have no LLM answer; run again to resume them.")
+
+    v_llm = [answers[idx] for idx in answered.index]
+    v_orig = answered['answer'].tolist()
+
+    # Embeddings for the LLM answers and the ground truth answers, encoded in batches
+    llm_embeddings = get_embedding_model().encode(v_llm, batch_size=EVAL_ENCODE_BATCH_SIZE)
+    orig_embeddings = get_embedding_model().encode(v_orig, batch_size=EVAL_ENCODE_BATCH_SIZE)
+    cosine_similarities = row_cosine_similarity(llm_embeddings, orig_embeddings).tolist() if v_llm else []
+
+    # Determine relevance (similarity > threshold implies relevance)
+    relevance_total = [[similarity_score > 0.5] for similarity_score in cosine_similarities]
 
     # Compute MRR and Hit Rate
     mrr_score = mrr(relevance_total)
@@ -110,13 +209,143 @@ def evaluate_llm_against_ground_truth(df):
     return v_llm, v_orig, mrr_score, hit_rate_score, cosine_similarities
 
 
+def normalize_phrase(text):
+    """
+    Lower case words and numbers of a text, separated by single spaces.
+    """
+    return ' '.join(re.findall(r'[a-z0-9]+', str(text).lower()))
+
+
+def product_names(hit):
+    """
+    Names a retrieved product may be referred to by: its cosmetic_name when the fields are stored,
+    otherwise every ending of two or more words of the '<brand> <name>' title its chunks start with.
+    """
+    source = hit.get('_source', {})
+    name = (source.get('fields') or {}).get('cosmetic_name')
+    if name:
+        return [name]
+    words = source.get('text', '').split('\n', 1)[0].split('. ', 1)[0].split()
+    return [' '.join(words[start:]) for start in range(len(words) - 1)]
+
+
+def ground_truth_matching(df):
+    """
+    Returns how retrieved products are matched with the rows of a ground truth DataFrame.
+    """
+    return 'product_id' if 'product_id' in df.columns else 'product_name'
+
+
+def is_relevant_hit(row, hit, matching='product_id'):
+    """
+    Decides whether a retrieved product is the source product of a ground truth row,
+    by product_id or by product name (see EVAL_MATCHING_MODES).
+    """
+    if matching == 'product_id':
+        return pd.notnull(row['product_id']) and hit['_id'] == row['product_id']
+    text = f" {normalize_phrase(row['question'])} {normalize_phrase(row['answer'])} "
+    return any(f" {name} " in text for name in map(normalize_phrase, product_names(hit)) if name)
+
+
+def benchmark_retrieval(df, k=5, search=None, batch_size=EVAL_ENCODE_BATCH_SIZE):
+    """
+    Measures retrieval quality and speed without the LLM.
+    All questions are encoded in batches, then search(embedding, k) runs for each of them
+    (search_documents with the configured backend by default). Returns Hit Rate@k, MRR@k, the
+    matching mode of the hits, search latency percentiles in milliseconds and queries per second.
+    """
+    matching = ground_truth_matching(df)
+    if matching != 'product_id':
+        logging.warning("The ground truth has no product_id column, hits are matched by product name.")
+    search = search or (lambda embedding, k: search_documents(embedding, k=k))
+    questions = df['question'].tolist()
+
+    encode_start = time.perf_counter()
+    question_embeddings = get_embedding_model().encode(questions, batch_size=batch_size)
+    encode_time = time.perf_counter() - encode_start
+
+    relevance_total = []
+    latencies = []
+    for (_, row), embedding in zip(df.iterrows(), question_embeddings):
+        search_start = time.perf_counter()
+        hits = search(embedding.tolist(), k)
+        latencies.append(time.perf_counter() - search_start)
+        relevance_total.append([is_relevant_hit(row, hit, matching) for hit in hits[:k]])
+
+    latencies_ms = np.asarray(latencies) * 1000
+    search_time = float(np.sum(latencies))
+    return {
+        'questions': len(questions),
+        'k': k,
+        'matching': matching,
+        'hit_rate': hit_rate(relevance_total),
+        'mrr': mrr(relevance_total),
+        'latency_p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else 0.0,
+        'latency_p95_ms': float(np.percentile(latencies_ms, 95)) if len(latencies) else 0.0,
+        'latency_p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else 0.0,
+        'queries_per_second': len(latencies) / search_time if search_time else 0.0,
+        'encode_questions_per_second': len(questions) / encode_time if encode_time else 0.0
+    }
+
+
+def make_search(backend, search_mode=None, num_candidates=None, rescore_window=None):
+    """
+    Returns a search(embedding, k) function for a retrieval backend and, for Elasticsearch,
+    a search mode, number of kNN candidates and rescore window.
+    """
+    options = {}
+    if backend == 'elasticsearch':
+        if search_mode:
+            options['mode'] = search_mode
+        if num_candidates:
+            options['num_candidates'] = num_candidates
+        if rescore_window is not None:
+            options['rescore_window'] = rescore_window
+    return lambda embedding, k: search_documents(embedding, k=k, backend=backend, **options)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the RAG answers against the ground truth dataset.")
+    parser.add_argument('--mode', choices=['llm', 'retrieval'], default='llm',
+                        help="'llm' evaluates generated answers, 'retrieval' benchmarks retrieval only.")
+    parser.add_argument('--num-rows', type=int, default=1000, help="Number of ground truth rows to evaluate.")
+    parser.add_argument('--concurrency', type=int, default=EVAL_CONCURRENCY, help="Concurrent LLM calls.")
+    parser.add_argument('--rpm', type=int, default=EVAL_REQUESTS_PER_MINUTE, help="LLM requests per minute (0 = no limit).")
+    parser.add_argument('--tpm', type=int, default=EVAL_TOKENS_PER_MINUTE, help="LLM tokens per minute (0 = no limit).")
+    parser.add_argument('--checkpoint', default=EVAL_CHECKPOINT_PATH,
+                        help="JSONL file of finished answers, used to resume an interrupted run.")
+    parser.add_argument('--ground-truth', default=None, help="Ground truth CSV (the published dataset by default).")
+    parser.add_argument('--k', type=int, default=5, help="Retrieval: number of documents per question.")
+    parser.add_argument('--backend', choices=['elasticsearch', 'local'], default=None,
+                        help="Retrieval: backend to benchmark (RETRIEVAL_BACKEND by default).")
+    parser.add_argument('--search-mode', choices=['knn', 'exact'], default=None,
+                        help="Retrieval: Elasticsearch search mode (ES_SEARCH_MODE by default).")
+    parser.add_argument('--num-candidates', type=int, default=None,
+                        help="Retrieval: kNN candidates per shard (ES_NUM_CANDIDATES by default).")
+    parser.add_argument('--rescore-window', type=int, default=None,
+                        help="Retrieval: kNN hits rescored with full-precision vectors, 0 = off (ES_RESCORE_WINDOW by default).")
+    args = parser.parse_args()
+
     # Load ground truth data
     ground_truth_url = "https://raw.githubusercontent.com/ovlasenko-ellation/LLM_project3/refs/heads/main/Data/ground_truth.csv"
-    df_ground_truth = load_ground_truth_data(ground_truth_url)
+    df_ground_truth = load_ground_truth_data(args.ground_truth or ground_truth_url, num_rows=args.num_rows)
 
-    # Evaluate LLM and print results
-    v_llm, v_orig, mrr_score, hit_rate_score, cosine_similarities = evaluate_llm_against_ground_truth(df_ground_truth)
+    if args.mode == 'retrieval':
+        es_options = args.search_mode or args.num_candidates or args.rescore_window is not None
+        backend = args.backend or ('elasticsearch' if es_options else None)
+        results = benchmark_retrieval(df_ground_truth, k=args.k,
+                                      search=make_search(backend, args.search_mode, args.num_candidates,
+                                                         args.rescore_window))
+        if (backend or RETRIEVAL_BACKEND) == 'elasticsearch':
+            # Index size next to recall, to weigh the vector index types against each other
+            results.update(get_index_stats())
+        print(json.dumps(results, indent=2))
+    else:
+        # Evaluate LLM and print results
+        v_llm, v_orig, mrr_score, hit_rate_score, cosine_similarities = evaluate_llm_against_ground_truth(
+            df_ground_truth, checkpoint_path=args.checkpoint, concurrency=args.concurrency,
+            requests_per_minute=args.rpm, tokens_per_minute=args.tpm
+        )
 
-    # Display cosine similarities for verification
-    print("Cosine Similarities between LLM answers and ground truth:", cosine_similarities)
+        # Display cosine similarities for verification
+        print("Cosine Similarities between LLM answers and ground truth:", cosine_similarities)
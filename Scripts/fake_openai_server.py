@@ -0,0 +1,154 @@
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI chat completions endpoint, for tests and benchmarks that
+# must not call the real API. Point a client at it with OPENAI_BASE_URL=http://localhost:8001/v1.
+# Answers are generated from the prompt, with a configurable latency, token rate and share of
+# 429 rate limit errors; both plain and streamed (server-sent events) responses are supported.
+
+
+def make_answer(prompt):
+    """
+    Builds a deterministic answer: question/answer pairs in CSV for ground truth prompts, otherwise a short sentence.
+    """
+    lines = [line for line in prompt.splitlines() if line.strip()]
+    subject = next((line.split(':', 1)[1].strip() for line in lines if line.startswith('Cosmetic Name:')), None)
+    if 'CSV format' in prompt:
+        subject = subject or 'this product'
+        rows = ['question,answer'] + [
+            f'"What should I know about {subject} ({i})?","{subject} is a skincare product, fact {i}."'
+            for i in range(1, 6)
+        ]
+        return '\n'.join(rows)
+    return f"This is a stub answer based on the context provided for: {lines[-1][:80] if lines else ''}"
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeOpenAI/1.0'
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        config = self.server.config
+        with self.server.lock:
+            self.server.requests += 1
+
+        if random.random() < config['rate_limit_rate']:
+            with self.server.lock:
+                self.server.rate_limited += 1
+            self.send_json(429, {'error': {'message': 'Rate limit reached (stub).', 'type': 'rate_limit_exceeded',
+                                           'code': 'rate_limit_exceeded'}},
+                           headers={'retry-after': str(config['retry_after'])})
+            return
+
+        prompt = '\n'.join(str(message.get('content', '')) for message in request.get('messages', []))
+        answer = make_answer(prompt)
+        model = request.get('model', 'gpt-4o-mini')
+        usage = {
+            'prompt_tokens': count_tokens(prompt),
+            'completion_tokens': count_tokens(answer),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        time.sleep(config['latency'])
+
+        if request.get('stream'):
+            self.stream_answer(completion_id, model, answer, usage, request.get('stream_options') or {})
+            return
+        if config['tokens_per_second']:
+            time.sleep(usage['completion_tokens'] / config['tokens_per_second'])  # Generation time of the answer
+        self.send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}],
+            'usage': usage
+        })
+
+    def stream_answer(self, completion_id, model, answer, usage, stream_options):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        def chunk(choices, chunk_usage=None):
+            body = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': model, 'choices': choices, 'usage': chunk_usage}
+            self.wfile.write(f"data: {json.dumps(body)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        delay = 1.0 / self.server.config['tokens_per_second'] if self.server.config['tokens_per_second'] else 0.0
+        words = answer.split(' ')
+        for i, word in enumerate(words):
+            content = word if i == 0 else ' ' + word
+            chunk([{'index': 0, 'delta': {'content': content}, 'finish_reason': None}])
+            if delay:
+                time.sleep(delay)
+        chunk([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if stream_options.get('include_usage'):
+            chunk([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(host='127.0.0.1', port=8001, latency=0.0, tokens_per_second=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0):
+    """
+    Starts the stub in a background thread and returns the server; stop it with server.shutdown().
+    Use port 0 to pick a free port (server.server_address[1]).
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.config = {'latency': latency, 'tokens_per_second': tokens_per_second,
+                     'rate_limit_rate': rate_limit_rate, 'retry_after': retry_after}
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.rate_limited = 0
+    threading.Thread(target=server.serve_forever, name='fake-openai', daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI chat completions API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds before the first token.")
+    parser.add_argument('--tokens-per-second', type=float, default=50.0, help="Answer generation speed, streamed or not (0 = no delay).")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After of the 429 responses.")
+    args = parser.parse_args()
+
+    stub = start_server(args.host, args.port, args.latency, args.tokens_per_second, args.rate_limit_rate,
+                        args.retry_after)
+    print(f"Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
@@ -1,33 +1,32 @@
 import pandas as pd
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
 import os
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import argparse
+import asyncio
 import csv
-import time
+import hashlib
 import logging
+import random
 from tqdm import tqdm  # For the progress bar
-
-# Set up OpenAI API key from environment variables
+from rate_limiter import RateLimiter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Prompt template
-prompt_template = """
-You are an AI-Powered Skincare Chatbot. 
-Your Objective: a skincare expert chatbot that answerimport pandas as pd
-from openai import OpenAI
-import os
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-import csv
-import time
-import logging
-from tqdm import tqdm  # For the progress bar
-
-# Set up OpenAI API key from environment variables
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Generation settings: at most GT_CONCURRENCY requests in flight under the requests/tokens per
+# minute limits. Rate limit and transient errors are retried up to GT_MAX_RETRIES times with
+# exponential backoff starting at GT_BACKOFF_BASE seconds. OPENAI_BASE_URL points the client at
+# a local stub (fake_openai_server.py) for tests.
+GT_MODEL = os.getenv('GT_MODEL', 'gpt-3.5-turbo')
+GT_CONCURRENCY = int(os.getenv('GT_CONCURRENCY', '8'))
+GT_REQUESTS_PER_MINUTE = int(os.getenv('GT_REQUESTS_PER_MINUTE', '500'))
+GT_TOKENS_PER_MINUTE = int(os.getenv('GT_TOKENS_PER_MINUTE', '200000'))
+GT_MAX_TOKENS = 1000
+GT_MAX_RETRIES = int(os.getenv('GT_MAX_RETRIES', '6'))
+GT_BACKOFF_BASE = float(os.getenv('GT_BACKOFF_BASE', '1.0'))
+GT_BACKOFF_MAX = float(os.getenv('GT_BACKOFF_MAX', '60.0'))
+
+OUTPUT_COLUMNS = ['question', 'answer', 'product_id']
 
 # Prompt template
 prompt_template = """
@@ -45,23 +44,26 @@ Provide the output in CSV format with two columns: question, answer.
 def load_source_data(csv_url):
     """
     Loads the source data from the provided CSV URL.
+    Columns are read as strings, like in data_preprocessing.py, so product ids match the document ids.
     """
     logging.info("Loading source data from CSV URL.")
-    df = pd.read_csv(csv_url)
+    df = pd.read_csv(csv_url, dtype=str)
     logging.info("Source data loaded successfully.")
     return df
 
 
-def generate_ground_truth(df):
+def generate_product_id(row):
     """
-    Generates ground truth data by creating question-answer pairs for each product.
+    Hash of the product row; the same id data_preprocessing.generate_hashed_id gives its document.
     """
-    logging.info("Starting to generate ground truth data.")
-    ground_truth = []
+    return hashlib.md5(str(row.to_dict()).encode()).hexdigest()
 
-    # Using tqdm for a progress bar
-    for index, row in tqdm(df.iterrows(), total=df.shape[0], desc="Processing products"):
-        product_info = f"""
+
+def build_product_prompt(row):
+    """
+    Fills the prompt template with the details of one product.
+    """
+    product_info = f"""
 Brand Name: {row.get('brand_name', '')}
 Cosmetic Name: {row.get('cosmetic_name', '')}
 Price: {row.get('price', '')}
@@ -71,148 +73,163 @@ Reviews: {row.get('reviews', '')}
 Recommended: {row.get('recommended', '')}
 Cosmetic Link: {row.get('cosmetic_link', '')}
 """.strip()
-        prompt = prompt_template.format(product_info=product_info)
-
-        # Call OpenAI API to generate question-answer pairs
-        try:
-            response = client.chat.completions.create(model='gpt-3.5-turbo',
-            messages=[
-                {'role': 'system', 'content': 'You are an AI language model assistant.'},
-                {'role': 'user', 'content': prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.7,
-            n=1)
-            output = response.choices[0].message.content
-
-            # Parse the output CSV
-            reader = csv.reader(output.strip().split('\n'))
-            for qa_row in reader:
-                if len(qa_row) == 2:
-                    question, answer = qa_row
-                    ground_truth.append({'question': question.strip(), 'answer': answer.strip()})
-        except Exception as e:
-            logging.error(f"Error generating ground truth for product index {index}: {e}")
-            time.sleep(1)  # Sleep to handle rate limits
-            continue
-
-    logging.info("Ground truth data generation completed.")
-    return pd.DataFrame(ground_truth)
+    return prompt_template.format(product_info=product_info)
 
 
-def save_ground_truth(df_ground_truth, output_path):
+def parse_qa_pairs(output):
     """
-    Saves the ground truth DataFrame to a CSV file in the specified directory.
+    Parses the question, answer rows of the CSV returned by the model, skipping a header row.
     """
-    logging.info(f"Saving ground truth data to {output_path}")
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    df_ground_truth.to_csv(output_path, index=False)
-    logging.info(f"Ground truth data saved successfully to {output_path}")
-
-
-if __name__ == "__main__":
-    # Load source data
-    csv_url = 'https://raw.githubusercontent.com/ovlasenko-ellation/LLM_project3/refs/heads/main/Data/Sephora_all.csv'
-    df = load_source_data(csv_url)
+    pairs = []
+    for qa_row in csv.reader(output.strip().split('\n')):
+        if len(qa_row) == 2:
+            question, answer = qa_row[0].strip(), qa_row[1].strip()
+            if question.lower() == 'question' and answer.lower() == 'answer':
+                continue
+            pairs.append((question, answer))
+    return pairs
 
-    # Optionally, process a subset of the data for testing
-    # df = df.head(10)
-
-    # Generate ground truth
-    df_ground_truth = generate_ground_truth(df)
-
-    # Save ground truth data
-    output_path = './Data/ground_truth.csv'
-    save_ground_truth(df_ground_truth, output_path)
-s user questions about product ingredients, routines, or skin concerns, recommending products, or suggesting routines.
-Formulate 5 questions a user might ask about the following skincare product, and provide relevant answers using information from the product details. The questions should be complete and not too short.
-
-Product Details:
-{product_info}
 
-Provide the output in CSV format with two columns: question, answer.
-""".strip()
+def load_done_product_ids(output_path):
+    """
+    Returns the ids of the products already in the output file.
+    """
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return set()
+    done = pd.read_csv(output_path, dtype=str)
+    if 'product_id' not in done.columns:
+        raise ValueError(f"{output_path} was written without product ids and cannot be resumed; "
+                         f"pass another --output (the default is ./Data/ground_truth_v2.csv).")
+    return set(done['product_id'].dropna())
 
 
-def load_source_data(csv_url):
+def backoff_delay(attempt, error=None):
     """
-    Loads the source data from the provided CSV URL.
+    Exponential backoff with jitter, or the Retry-After of a rate limit response when it is longer.
     """
-    logging.info("Loading source data from CSV URL.")
-    df = pd.read_csv(csv_url)
-    logging.info("Source data loaded successfully.")
-    return df
+    delay = min(GT_BACKOFF_MAX, GT_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get('retry-after', 0)))
+        except ValueError:
+            pass
+    return delay
 
 
-def generate_ground_truth(df):
+async def generate_qa_pairs(client, limiter, semaphore, prompt):
+    """
+    Asks the model for the question-answer pairs of one product, retrying rate limit
+    and transient errors with exponential backoff.
+    """
+    messages = [
+        {'role': 'system', 'content': 'You are an AI language model assistant.'},
+        {'role': 'user', 'content': prompt}
+    ]
+    # About 4 characters per prompt token plus the completion budget
+    estimated_tokens = len(prompt) // 4 + GT_MAX_TOKENS
+    async with semaphore:
+        for attempt in range(GT_MAX_RETRIES + 1):
+            await limiter.acquire_async(estimated_tokens)
+            try:
+                response = await client.chat.completions.create(model=GT_MODEL, messages=messages,
+                                                                max_tokens=GT_MAX_TOKENS, temperature=0.7, n=1)
+            except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+                limiter.record_usage(estimated_tokens, 0)
+                if attempt == GT_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt, e)
+                logging.warning(f"{type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1}).")
+                await asyncio.sleep(delay)
+                continue
+            if response.usage is not None:
+                limiter.record_usage(estimated_tokens, response.usage.total_tokens)
+            return parse_qa_pairs(response.choices[0].message.content)
+
+
+async def generate_ground_truth(df, output_path, concurrency=GT_CONCURRENCY,
+                                requests_per_minute=GT_REQUESTS_PER_MINUTE, tokens_per_minute=GT_TOKENS_PER_MINUTE):
     """
-    Generates ground truth data by creating question-answer pairs for each product.
+    Generates question-answer pairs for every product and appends them to the output CSV as they arrive.
+    Products already in the output file are skipped, so an interrupted run can be resumed.
+    Returns the number of products processed in this run.
     """
     logging.info("Starting to generate ground truth data.")
-    ground_truth = []
-
-    # Using tqdm for a progress bar
-    for index, row in tqdm(df.iterrows(), total=df.shape[0], desc="Processing products"):
-        product_info = f"""
-Brand Name: {row.get('brand_name', '')}
-Cosmetic Name: {row.get('cosmetic_name', '')}
-Price: {row.get('price', '')}
-Ingredients: {row.get('ingredients', '')}
-About: {row.get('about', '')}
-Reviews: {row.get('reviews', '')}
-Recommended: {row.get('recommended', '')}
-Cosmetic Link: {row.get('cosmetic_link', '')}
-""".strip()
-        prompt = prompt_template.format(product_info=product_info)
-
-        # Call OpenAI API to generate question-answer pairs
+    done = load_done_product_ids(output_path)
+    products = {}
+    for _, row in df.iterrows():
+        product_id = generate_product_id(row)
+        if product_id not in done and product_id not in products:
+            products[product_id] = build_product_prompt(row)
+    logging.info(f"{len(done)} products already done, {len(products)} to go.")
+    if not products:
+        return 0
+
+    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)  # Retries are handled here
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(product_id, prompt):
         try:
-            response = client.chat.completions.create(model='gpt-3.5-turbo',
-            messages=[
-                {'role': 'system', 'content': 'You are an AI language model assistant.'},
-                {'role': 'user', 'content': prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.7,
-            n=1)
-            output = response.choices[0].message.content
-
-            # Parse the output CSV
-            reader = csv.reader(output.strip().split('\n'))
-            for qa_row in reader:
-                if len(qa_row) == 2:
-                    question, answer = qa_row
-                    ground_truth.append({'question': question.strip(), 'answer': answer.strip()})
+            return product_id, await generate_qa_pairs(client, limiter, semaphore, prompt)
         except Exception as e:
-            logging.error(f"Error generating ground truth for product index {index}: {e}")
-            time.sleep(1)  # Sleep to handle rate limits
-            continue
+            logging.error(f"Error generating ground truth for product {product_id}: {e}")
+            return product_id, None
+
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    write_header = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+    processed = 0
+    with open(output_path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(OUTPUT_COLUMNS)
+        tasks = [asyncio.ensure_future(generate(product_id, prompt)) for product_id, prompt in products.items()]
+        try:
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing products"):
+                product_id, pairs = await task
+                if pairs is None:
+                    continue  # Left for the next run
+                if not pairs:
+                    logging.warning(f"No question-answer pairs parsed for product {product_id}.")
+                writer.writerows((question, answer, product_id) for question, answer in pairs)
+                f.flush()
+                processed += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+            await client.close()
 
     logging.info("Ground truth data generation completed.")
-    return pd.DataFrame(ground_truth)
-
-
-def save_ground_truth(df_ground_truth, output_path):
-    """
-    Saves the ground truth DataFrame to a CSV file in the specified directory.
-    """
-    logging.info(f"Saving ground truth data to {output_path}")
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    df_ground_truth.to_csv(output_path, index=False)
-    logging.info(f"Ground truth data saved successfully to {output_path}")
+    return processed
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate question-answer ground truth for every product.")
+    parser.add_argument('--source', default='https://raw.githubusercontent.com/ovlasenko-ellation/LLM_project3/refs/heads/main/Data/Sephora_all.csv',
+                        help="Product catalog CSV.")
+    # ./Data/ground_truth.csv predates product ids, so it cannot be resumed and is kept as is
+    parser.add_argument('--output', default='./Data/ground_truth_v2.csv', help="Output CSV, resumed when it exists.")
+    parser.add_argument('--limit', type=int, default=None, help="Only process the first LIMIT products.")
+    parser.add_argument('--concurrency', type=int, default=GT_CONCURRENCY, help="Concurrent API requests.")
+    parser.add_argument('--rpm', type=int, default=GT_REQUESTS_PER_MINUTE, help="Requests per minute (0 = no limit).")
+    parser.add_argument('--tpm', type=int, default=GT_TOKENS_PER_MINUTE, help="Tokens per minute (0 = no limit).")
+    args = parser.parse_args()
+
+    # Refuse a file without product ids before downloading the catalog
+    try:
+        load_done_product_ids(args.output)
+    except ValueError as e:
+        parser.error(str(e))
+
     # Load source data
-    csv_url = 'https://raw.githubusercontent.com/ovlasenko-ellation/LLM_project3/refs/heads/main/Data/Sephora_all.csv'
-    df = load_source_data(csv_url)
+    df = load_source_data(args.source)
 
     # Optionally, process a subset of the data for testing
-    # df = df.head(10)
-
-    # Generate ground truth
-    df_ground_truth = generate_ground_truth(df)
+    if args.limit:
+        df = df.head(args.limit)
 
-    # Save ground truth data
-    output_path = './Data/ground_truth.csv'
-    save_ground_truth(df_ground_truth, output_path)
+    # Generate ground truth, appending to the output file
+    processed = asyncio.run(generate_ground_truth(df, args.output, concurrency=args.concurrency,
+                                                  requests_per_minute=args.rpm, tokens_per_minute=args.tpm))
+    logging.info(f"Ground truth for {processed} products saved to {args.output}")
@@ -0,0 +1,107 @@
+import logging
+import numpy as np
+from elasticsearch.helpers import scan
+from chunking import parent_id_of
+from embedding_snapshot import EmbeddingSnapshot
+
+
+class LocalVectorIndex:
+    """
+    In-process vector index over the product embeddings.
+    All vectors are kept L2-normalised in one contiguous float32 matrix, so a top-k query
+    is a single matrix-vector product followed by argpartition.
+    Already normalised float16/int8 vectors (e.g. a memory-mapped snapshot) are used as they
+    are and scored block by block, so they are never copied into process memory as a whole.
+    Hits carry the parent_id of their product, so chunk hits can be grouped like Elasticsearch ones.
+    """
+
+    block_size = 16384
+
+    def __init__(self, ids, texts, embeddings, scales=None, normalized=False, parent_ids=None):
+        if normalized:
+            self.vectors = embeddings
+        else:
+            vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+            if vectors.ndim != 2:
+                vectors = vectors.reshape(len(ids), -1)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0  # Leave zero vectors as they are instead of dividing by zero
+            self.vectors = vectors / norms
+        self.scales = scales
+        self.ids = ids if normalized else list(ids)
+        self.texts = texts if normalized else list(texts)
+        # Without parent ids (e.g. an older snapshot) the product is derived from the chunk id
+        self.parent_ids = parent_ids if normalized or parent_ids is None else list(parent_ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_elasticsearch(cls, es_client, index_name='cosmetics_index', batch_size=1000):
+        """
+        Loads ids, texts, product ids and embeddings of every document in the index with a scroll.
+        """
+        ids, texts, parent_ids, embeddings = [], [], [], []
+        query = {"query": {"match_all": {}}, "_source": ["id", "text", "parent_id", "embedding"]}
+        for hit in scan(es_client, index=index_name, query=query, size=batch_size):
+            source = hit['_source']
+            ids.append(hit['_id'])
+            texts.append(source.get('text', ''))
+            parent_ids.append(parent_id_of(hit))
+            embeddings.append(np.asarray(source['embedding'], dtype=np.float32))
+        matrix = np.vstack(embeddings) if embeddings else np.zeros((0, 384), dtype=np.float32)
+        logging.info(f"Loaded {len(ids)} documents from '{index_name}' into the local vector index.")
+        return cls(ids, texts, matrix, parent_ids=parent_ids)
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """
+        Opens a snapshot written by embedding_snapshot.py without loading it into memory.
+        """
+        snapshot = EmbeddingSnapshot(path)
+        logging.info(f"Opened snapshot {path} with {len(snapshot)} {snapshot.dtype} vectors.")
+        return cls(snapshot.ids, snapshot.texts, snapshot.vectors, scales=snapshot.scales, normalized=True,
+                   parent_ids=snapshot.parent_ids)
+
+    def scores(self, query):
+        """
+        Computes the cosine similarity of a normalised query with every document.
+        """
+        if self.vectors.dtype == np.float32:
+            scores = self.vectors @ query
+        else:
+            scores = np.empty(len(self), dtype=np.float32)
+            for start in range(0, len(self), self.block_size):
+                block = np.asarray(self.vectors[start:start + self.block_size], dtype=np.float32)
+                scores[start:start + len(block)] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, embedding, k=5):
+        """
+        Returns the top k documents by cosine similarity, in the same format as Elasticsearch hits.
+        Scores are cosine + 1.0, like the exact script_score search.
+        """
+        if len(self) == 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            logging.error("Cannot search the local vector index with a zero vector.")
+            return []
+
+        scores = self.scores(query / norm)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = []
+        for i in top:
+            hit = {
+                "_id": self.ids[i],
+                "_score": float(scores[i]) + 1.0,
+                "_source": {"id": self.ids[i], "text": self.texts[i]}
+            }
+            hit['_source']['parent_id'] = self.parent_ids[i] if self.parent_ids is not None else parent_id_of(hit)
+            hits.append(hit)
+        return hits
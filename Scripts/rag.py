@@ -1,11 +1,16 @@
-from openai import OpenAI
-from sentence_transformers import SentenceTransformer
 import os
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-from elasticsearch import Elasticsearch
 import numpy as np
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from local_index import LocalVectorIndex
+from embedding_cache import EmbeddingCache
+from semantic_cache import SemanticAnswerCache
+from catalog import get_catalog_version
+from token_budget import pack_context, count_tokens
+from resources import EMBEDDING_MODEL_NAME, get_embedding_model, get_openai_client, get_es_client
+from chunking import group_chunk_hits
 
 # Set up logging for debugging and tracking
 logging.basicConfig(level=logging.INFO)
@@ -14,13 +19,64 @@ logging.basicConfig(level=logging.INFO)
 #if not openai.api_key:
 #    raise ValueError("OpenAI API key not set. Please set it in your environment variables.")
 
-# Elasticsearch client configuration
-ES_HOST = os.getenv('ES_HOST', 'localhost')
-es = Elasticsearch([f'http://{ES_HOST}:9200'])  # Adjust the host and port as needed
-
-# Load the SentenceTransformer model globally
-model_name = 'all-MiniLM-L6-v2'  # or any other compatible model
-embedding_model = SentenceTransformer(model_name)
+# The embedding model and the OpenAI and Elasticsearch clients (ES_HOST) are built on first use
+# and shared with the other modules through resources.py
+
+# Vector search settings: 'knn' uses the approximate HNSW index, 'exact' scores every
+# document with a script_score query and serves as the exact-recall baseline
+ES_SEARCH_MODE = os.getenv('ES_SEARCH_MODE', 'knn')
+ES_NUM_CANDIDATES = int(os.getenv('ES_NUM_CANDIDATES', '100'))
+# With a quantized index (VECTOR_INDEX_TYPE=int8_hnsw or bbq_hnsw at ingestion) the top ES_RESCORE_WINDOW kNN hits
+# are rescored with the full-precision vectors; 0 keeps the kNN scores
+ES_RESCORE_WINDOW = int(os.getenv('ES_RESCORE_WINDOW', '0'))
+
+# Retrieval backend used by get_answer: 'elasticsearch' or 'local' (in-process NumPy index)
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', 'elasticsearch')
+# Optional snapshot written by embedding_snapshot.py; the local index memory-maps it instead of
+# scrolling the whole index from Elasticsearch
+LOCAL_INDEX_SNAPSHOT = os.getenv('LOCAL_INDEX_SNAPSHOT')
+local_index = None  # Built lazily on first use of the local backend
+local_index_lock = threading.Lock()
+
+# The index holds chunks of products: retrieval fetches CHUNK_CANDIDATES_FACTOR times k chunks,
+# groups them by product and returns the top k products with at most CHUNKS_PER_PRODUCT chunks each
+CHUNK_CANDIDATES_FACTOR = int(os.getenv('CHUNK_CANDIDATES_FACTOR', '4'))
+CHUNKS_PER_PRODUCT = int(os.getenv('CHUNKS_PER_PRODUCT', '3'))
+
+model_name = EMBEDDING_MODEL_NAME
+
+# Cache of question embeddings: an in-memory LRU of EMBEDDING_CACHE_SIZE entries, plus an
+# optional SQLite file at EMBEDDING_CACHE_PATH that survives restarts
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '1024'))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH')
+embedding_cache = EmbeddingCache(max_size=EMBEDDING_CACHE_SIZE, persist_path=EMBEDDING_CACHE_PATH,
+                                 namespace=model_name)
+
+# Semantic answer cache: questions within SEMANTIC_CACHE_THRESHOLD cosine similarity of a cached
+# question get its answer without calling the LLM. Cached answers are dropped when the catalog
+# version stored in the index changes (checked every CATALOG_VERSION_CHECK_INTERVAL seconds)
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', '0') == '1'  # Off by default, see the README
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '3600'))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '1000'))
+CATALOG_VERSION_CHECK_INTERVAL = int(os.getenv('CATALOG_VERSION_CHECK_INTERVAL', '60'))
+semantic_cache = SemanticAnswerCache(threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL,
+                                     max_entries=SEMANTIC_CACHE_SIZE)
+last_catalog_check = 0.0
+catalog_version = None  # Version of the catalog the local index was loaded from
+
+# get_answer and get_answer_stream score relevance before returning unless called with async_relevance=True.
+# Then it runs on RELEVANCE_WORKERS background threads and the answer data carries a 'relevance_future',
+# whose result the app writes to the stored conversation once it is ready. RELEVANCE_ASYNC=0 turns that off in the app
+RELEVANCE_ASYNC = os.getenv('RELEVANCE_ASYNC', '1') == '1'
+RELEVANCE_WORKERS = int(os.getenv('RELEVANCE_WORKERS', '2'))
+RELEVANCE_PENDING = 'PENDING'
+relevance_executor = ThreadPoolExecutor(max_workers=RELEVANCE_WORKERS, thread_name_prefix='relevance')
+
+# Most tokens the retrieved documents may take up in the prompt, counted with the tokenizer of TOKENIZER_MODEL.
+# Fields are packed by priority across the hits (see token_budget.CONTEXT_FIELDS)
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+TOKENIZER_MODEL = os.getenv('TOKENIZER_MODEL', 'gpt-4o-mini')
 
 def get_user_question():
     """
@@ -30,9 +86,10 @@ def get_user_question():
     logging.info(f"User question: {question}")
     return question
 
-def generate_question_embedding(question):
+def generate_question_embedding(question, use_cache=True):
     """
     Generates vector embedding for the user question using SentenceTransformer.
+    Embeddings are looked up in the embedding cache first unless use_cache is False.
     """
     if not question:
         logging.warning("Warning: No question provided for embedding.")
@@ -40,45 +97,186 @@ def generate_question_embedding(question):
 
     try:
         # Generate embedding using the SentenceTransformer model
-        embedding = embedding_model.encode(question).tolist()
+        if use_cache:
+            # The model is only loaded on a cache miss
+            embedding = embedding_cache.get_or_compute(
+                question, lambda text: get_embedding_model().encode(text)).tolist()
+        else:
+            embedding = get_embedding_model().encode(question).tolist()
         logging.info(f"Generated embedding for the question: {embedding}")
         return embedding
     except Exception as e:
         logging.error(f"Error generating embedding: {e}")
         return [0.0] * 384  # Return a zero vector in case of an error
 
-def search_es(embedding, index_name='cosmetics_index', k=5):
+def build_es_query(embedding, k=5, mode=ES_SEARCH_MODE, num_candidates=ES_NUM_CANDIDATES,
+                   rescore_window=ES_RESCORE_WINDOW):
     """
-    Searches in Elasticsearch for the closest elements using vector similarity.
+    Builds the Elasticsearch search body for the given search mode.
+    'knn' scores are (1 + cosine) / 2, 'exact' and rescored 'knn' scores are cosine + 1.
+    The embeddings are left out of the returned documents.
     """
-    query = {
-       "size": k,
-       "query": {
-            "script_score": {
-                "query": {"match_all": {}},
-                "script": {
-                    "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
-                    "params": {"query_vector": embedding}
+    exact_score = {
+        "source": "cosineSimilarity(params.query_vector, 'embedding') + 1.0",
+        "params": {"query_vector": embedding}
+    }
+    if mode == 'knn' and rescore_window:
+        # The knn query (unlike the top-level knn section) can be combined with a rescorer
+        return {
+            "size": k,
+            "_source": {"excludes": ["embedding"]},
+            "query": {
+                "knn": {
+                    "field": "embedding",
+                    "query_vector": embedding,
+                    "num_candidates": max(num_candidates, rescore_window, k)
+                }
+            },
+            "rescore": {
+                "window_size": max(rescore_window, k),
+                "query": {
+                    "rescore_query": {"script_score": {"query": {"match_all": {}}, "script": exact_score}},
+                    "query_weight": 0.0,
+                    "rescore_query_weight": 1.0
                 }
             }
         }
-    }
-    print(len(embedding))
+    if mode == 'knn':
+        return {
+            "size": k,
+            "_source": {"excludes": ["embedding"]},
+            "knn": {
+                "field": "embedding",
+                "query_vector": embedding,
+                "k": k,
+                "num_candidates": max(num_candidates, k)
+            }
+        }
+    if mode == 'exact':
+        return {
+            "size": k,
+            "_source": {"excludes": ["embedding"]},
+            "query": {
+                "script_score": {
+                    "query": {"match_all": {}},
+                    "script": exact_score
+                }
+            }
+        }
+    raise ValueError(f"Unknown search mode: {mode}")
+
+def get_embedding_cache_stats():
+    """
+    Returns the hit/miss counters of the question embedding cache.
+    """
+    return embedding_cache.stats()
+
+def search_es(embedding, index_name='cosmetics_index', k=5, mode=ES_SEARCH_MODE, num_candidates=ES_NUM_CANDIDATES,
+              rescore_window=ES_RESCORE_WINDOW):
+    """
+    Searches in Elasticsearch for the closest elements using vector similarity.
+    """
+    query = build_es_query(embedding, k=k, mode=mode, num_candidates=num_candidates, rescore_window=rescore_window)
     try:
-        response = es.search(index=index_name, body=query)
-        hits = response['hits']['hits']
-        print(hits)
-        return hits
+        response = get_es_client().search(index=index_name, body=query)
+        return response['hits']['hits']
     except Exception as e:
         logging.error(f"Error searching Elasticsearch: {e}")
         return []
 
-def create_context(hits):
+def get_index_stats(index_name='cosmetics_index'):
+    """
+    Returns the number of documents and the store size of the index, for comparing vector index types.
+    """
+    try:
+        stats = get_es_client().indices.stats(index=index_name, metric='docs,store')['_all']['primaries']
+        return {
+            'index_docs': stats['docs']['count'],
+            'index_store_mb': stats['store']['size_in_bytes'] / 1024 ** 2
+        }
+    except Exception as e:
+        logging.error(f"Error reading index stats: {e}")
+        return {}
+
+def get_local_index(index_name='cosmetics_index'):
+    """
+    Returns the in-process vector index, loading it from the snapshot or Elasticsearch on first use.
+    """
+    global local_index, catalog_version
+    if local_index is None:
+        with local_index_lock:
+            if local_index is None:
+                # Read first, so a re-index during the load shows up as a change
+                catalog_version = get_catalog_version(get_es_client(), index_name)
+                if LOCAL_INDEX_SNAPSHOT and os.path.exists(LOCAL_INDEX_SNAPSHOT):
+                    local_index = LocalVectorIndex.from_snapshot(LOCAL_INDEX_SNAPSHOT)
+                else:
+                    local_index = LocalVectorIndex.from_elasticsearch(get_es_client(), index_name)
+    return local_index
+
+def search_local(embedding, index_name='cosmetics_index', k=5):
+    """
+    Searches the in-process vector index for the closest elements using cosine similarity.
+    """
+    try:
+        return get_local_index(index_name).search(embedding, k)
+    except Exception as e:
+        logging.error(f"Error searching the local vector index: {e}")
+        return []
+
+def search_documents(embedding, index_name='cosmetics_index', k=5, backend=None, **search_options):
+    """
+    Retrieves the top k products from the configured backend, grouping the matching chunks per product.
+    Falls back to the local index, when it is already loaded, if Elasticsearch returns nothing.
+    search_options (mode, num_candidates, rescore_window) are passed on to the Elasticsearch search.
+    """
+    backend = backend or RETRIEVAL_BACKEND
+    num_chunks = k * CHUNK_CANDIDATES_FACTOR
+    if backend == 'local':
+        hits = search_local(embedding, index_name=index_name, k=num_chunks)
+    else:
+        hits = search_es(embedding, index_name=index_name, k=num_chunks, **search_options)
+        if not hits and local_index is not None:
+            logging.warning("No hits from Elasticsearch, falling back to the local vector index.")
+            hits = local_index.search(embedding, num_chunks)
+    return group_chunk_hits(hits, k=k, chunks_per_product=CHUNKS_PER_PRODUCT)
+
+def check_catalog_version(index_name='cosmetics_index'):
     """
-    Creates context by concatenating the first 5 descriptions from search results.
+    Drops the local index, and invalidates the semantic answer cache when it is enabled, once the catalog
+    was re-indexed. The version in Elasticsearch is read at most once per CATALOG_VERSION_CHECK_INTERVAL,
+    and only while there is something to invalidate.
     """
-    contexts = [hit['_source'].get('text', 'No description available') for hit in hits]
-    context = "\n\n".join(contexts)
+    global last_catalog_check, local_index, catalog_version
+    now = time.time()
+    if now - last_catalog_check < CATALOG_VERSION_CHECK_INTERVAL:
+        return
+    if not SEMANTIC_CACHE_ENABLED and local_index is None:
+        return
+    last_catalog_check = now
+    version = get_catalog_version(get_es_client(), index_name)
+    if version is None:
+        return
+    if SEMANTIC_CACHE_ENABLED and semantic_cache.set_catalog_version(version):
+        logging.info(f"Catalog version changed to {version}, cached answers invalidated.")
+    if catalog_version is not None and version != catalog_version:
+        logging.info(f"Catalog version changed to {version}, the local index is reloaded on next use.")
+        with local_index_lock:
+            local_index = None
+    catalog_version = version
+
+def create_context(hits, max_tokens=CONTEXT_TOKEN_BUDGET):
+    """
+    Creates context from the search results within a budget of max_tokens tokens.
+    Product names, brands and prices of all hits come first, then their descriptions,
+    ingredients and reviews as far as the budget allows.
+    """
+    context, context_tokens = pack_context(hits, max_tokens, TOKENIZER_MODEL)
+    logging.info(f"Context of {context_tokens} tokens from {len(hits)} documents.")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        # Tokenizes every full text again, so only worth it when tuning the budget
+        full_tokens = sum(count_tokens(hit['_source'].get('text', ''), TOKENIZER_MODEL) for hit in hits)
+        logging.debug(f"The full texts of the documents have {full_tokens} tokens.")
     return context
 
 def build_prompt(question, context):
@@ -99,15 +297,19 @@ def build_prompt(question, context):
     prompt = prompt_template.format(question=question, context=context)
     return prompt
 
+def log_prompt(prompt):
+    """
+    Logs the full prompt sent to the LLM at debug level.
+    """
+    logging.debug(f"Prompt:\n{100 * '-'}\n{prompt}\n{100 * '-'}")
+
 def llm(prompt, model_choice='gpt-4o-mini'):
     """
     Calls the LLM with the prompt using OpenAI's ChatCompletion API.
     """
-    print(100*'-')
-    print(prompt)
-    print(100 * '-')
+    log_prompt(prompt)
     try:
-        response = client.chat.completions.create(model=model_choice,
+        response = get_openai_client().chat.completions.create(model=model_choice,
         messages=[{"role": "user", "content": prompt}])
         answer = response.choices[0].message.content
         # Get token usage
@@ -120,6 +322,41 @@ def llm(prompt, model_choice='gpt-4o-mini'):
         logging.error(f"Error calling OpenAI API: {e}")
         return "I'm sorry, but I couldn't retrieve a response at this time."
 
+def llm_stream(prompt, result, model_choice='gpt-4o-mini'):
+    """
+    Streaming variant of llm: yields the answer text as it arrives from the API.
+    Once the stream is exhausted, result holds the answer, model_used, total_tokens, openai_cost
+    and whether the call failed. If the stream breaks off, a notice is yielded after the partial
+    answer, but result['answer'] keeps only the text the model generated.
+    """
+    log_prompt(prompt)
+    result.update({'answer': '', 'model_used': model_choice, 'total_tokens': 0, 'openai_cost': 0.0,
+                   'failed': False})
+    parts = []
+    try:
+        stream = get_openai_client().chat.completions.create(model=model_choice,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        stream_options={"include_usage": True})
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+            # The last chunk carries the token usage of the whole request
+            if chunk.usage is not None:
+                result['total_tokens'] = chunk.usage.total_tokens
+                result['openai_cost'] = calculate_openai_cost(chunk.usage, model_choice)
+        result['answer'] = ''.join(parts)
+    except Exception as e:
+        logging.error(f"Error calling OpenAI API: {e}")
+        result['failed'] = True
+        if parts:
+            result['answer'] = ''.join(parts)
+            yield "\n\n*[The answer was interrupted by an error and is incomplete.]*"
+        else:
+            result['answer'] = "I'm sorry, but I couldn't retrieve a response at this time."
+            yield result['answer']
+
 
 def calculate_openai_cost(usage, model_choice):
     """
@@ -139,12 +376,15 @@ def calculate_openai_cost(usage, model_choice):
     return total_cost
 
 
-def evaluate_relevance(question, answer):
+def evaluate_relevance(question, answer, question_embedding=None):
     """
     Evaluates the relevance of the response using cosine similarity.
+    The question embedding from retrieval is reused when given.
     """
-    question_embedding = generate_question_embedding(question)
-    answer_embedding = generate_question_embedding(answer)
+    if question_embedding is None:
+        question_embedding = generate_question_embedding(question)
+    # Answers are rarely repeated, so they are not stored in the embedding cache
+    answer_embedding = generate_question_embedding(answer, use_cache=False)
 
     # Check if embeddings are valid
     if question_embedding is None or answer_embedding is None:
@@ -162,74 +402,149 @@ def evaluate_relevance(question, answer):
     cosine_similarity = np.dot(question_embedding, answer_embedding) / (norm_q * norm_a)
     return cosine_similarity
 
-def get_answer(question):
+def prepare_prompt(question, start_time, timings=None):
     """
-    Gets the reply from the LLM and evaluates relevance.
-    Accepts a user's question and returns a dictionary with the answer and monitoring information.
+    Runs the steps before the LLM call: question embedding, semantic cache lookup, retrieval and prompt building.
+    Returns (answer_data, None, None) when the question is answered without the LLM,
+    otherwise (None, question_embedding, prompt). The duration of each step is added to timings.
     """
-    start_time = time.time()
-    answer_data = {}
-    try:
-        # Generate embedding for the question
-        question_embedding = generate_question_embedding(question)
+    timings = {} if timings is None else timings
 
-        if question_embedding is None:
-            error_msg = "Error generating embedding for the question. Please try again."
-            print(error_msg)
-            answer_data = {
-                'answer': error_msg,
-                'response_time': time.time() - start_time,
-                'relevance': "N/A",
-                'model_used': "N/A",
-                'total_tokens': 0,
-                'openai_cost': 0.0
-            }
-            return answer_data
+    # Generate embedding for the question
+    stage_start = time.time()
+    question_embedding = generate_question_embedding(question)
+    timings['embedding_time'] = time.time() - stage_start
+
+    if question_embedding is None:
+        error_msg = "Error generating embedding for the question. Please try again."
+        print(error_msg)
+        answer_data = {
+            'answer': error_msg,
+            'response_time': time.time() - start_time,
+            'relevance': "N/A",
+            'model_used': "N/A",
+            'total_tokens': 0,
+            'openai_cost': 0.0
+        }
+        return answer_data, None, None
 
-        # Search in ElasticSearch to get the top k documents
-        hits = search_es(question_embedding)
+    check_catalog_version()
 
-        if not hits:
-            error_msg = "No relevant information found in Elasticsearch. Please try again later."
-            print(error_msg)
+    # Answer near-duplicates of previous questions from the semantic cache
+    if SEMANTIC_CACHE_ENABLED:
+        cached_answer, similarity = semantic_cache.lookup(question_embedding)
+        if cached_answer is not None:
+            logging.info(f"Semantic cache hit for '{cached_answer['question']}' (similarity {similarity:.3f})")
             answer_data = {
-                'answer': error_msg,
+                'answer': cached_answer['answer'],
                 'response_time': time.time() - start_time,
-                'relevance': "N/A",
-                'model_used': "N/A",
+                'relevance': cached_answer['relevance'],
+                'model_used': 'cache',
                 'total_tokens': 0,
                 'openai_cost': 0.0
             }
-            return answer_data
+            return answer_data, None, None
+
+    # Search the retrieval backend to get the top k documents
+    stage_start = time.time()
+    hits = search_documents(question_embedding)
+    timings['retrieval_time'] = time.time() - stage_start
+
+    if not hits:
+        error_msg = "No relevant information found in Elasticsearch. Please try again later."
+        print(error_msg)
+        answer_data = {
+            'answer': error_msg,
+            'response_time': time.time() - start_time,
+            'relevance': "N/A",
+            'model_used': "N/A",
+            'total_tokens': 0,
+            'openai_cost': 0.0
+        }
+        return answer_data, None, None
+
+    # Create context from the retrieved documents
+    stage_start = time.time()
+    context = create_context(hits)
 
-        # Create context from the retrieved documents
-        context = create_context(hits)
+    # Build the prompt
+    prompt = build_prompt(question, context)
+    timings['prompt_time'] = time.time() - stage_start
+    logging.info(f"Prompt of {count_tokens(prompt, TOKENIZER_MODEL)} tokens.")
+    return None, question_embedding, prompt
 
-        # Build the prompt
-        prompt = build_prompt(question, context)
+def score_relevance(question, question_embedding, answer, cache_answer=True):
+    """
+    Evaluates the relevance of an answer and stores the answer in the semantic cache
+    unless cache_answer is False. Returns the relevance score (or "N/A") and the scoring time.
+    """
+    stage_start = time.time()
+    relevance_score = evaluate_relevance(question, answer, question_embedding)
+    relevance_time = time.time() - stage_start
+    if relevance_score is None:
+        relevance_score = "N/A"
+
+    if SEMANTIC_CACHE_ENABLED and cache_answer:
+        semantic_cache.store(question, question_embedding, {'answer': answer, 'relevance': relevance_score})
+    return relevance_score, relevance_time
+
+def finalize_answer(question, question_embedding, answer_data, start_time, cache_answer=True,
+                    async_relevance=False):
+    """
+    Completes the monitoring information of a generated answer. The response time covers
+    retrieval and generation only; with async_relevance, relevance is scored in the background,
+    leaving relevance PENDING and a future of (relevance, relevance_time) under 'relevance_future'.
+    """
+    # Calculate response time
+    answer_data['response_time'] = time.time() - start_time
+
+    # Evaluate the relevance of the answer
+    if async_relevance:
+        answer_data['relevance'] = RELEVANCE_PENDING
+        answer_data['relevance_future'] = relevance_executor.submit(
+            score_relevance, question, question_embedding, answer_data['answer'], cache_answer
+        )
+    else:
+        answer_data['relevance'], answer_data['relevance_time'] = score_relevance(
+            question, question_embedding, answer_data['answer'], cache_answer
+        )
+    return answer_data
+
+def get_answer(question, async_relevance=False):
+    """
+    Gets the reply from the LLM and evaluates relevance.
+    Accepts a user's question and returns a dictionary with the answer and monitoring information.
+    With async_relevance the relevance is left PENDING and scored in the background (see finalize_answer).
+    """
+    start_time = time.time()
+    answer_data = {}
+    timings = {}
+    try:
+        answer_data, question_embedding, prompt = prepare_prompt(question, start_time, timings)
+        if answer_data is not None:
+            answer_data['first_token_time'] = answer_data['response_time']
+            answer_data.update(timings)
+            return answer_data
 
         # Get the LLM's answer and additional info
+        stage_start = time.time()
         answer, model_used, total_tokens, openai_cost = llm(prompt)
+        timings['llm_time'] = time.time() - stage_start
 
-        # Evaluate the relevance of the answer
-        relevance_score = evaluate_relevance(question, answer)
-        if relevance_score is None:
-            relevance_score = "N/A"
-
-        # Calculate response time
-        response_time = time.time() - start_time
+        # Without streaming the first token reaches the user together with the full answer
+        first_token_time = time.time() - start_time
 
         # Prepare the answer data dictionary
         answer_data = {
             'answer': answer,
-            'response_time': response_time,
-            'relevance': relevance_score,
+            'first_token_time': first_token_time,
             'model_used': model_used,
             'total_tokens': total_tokens,
-            'openai_cost': openai_cost
+            'openai_cost': openai_cost,
+            **timings
         }
-
-        return answer_data
+        return finalize_answer(question, question_embedding, answer_data, start_time,
+                               async_relevance=async_relevance)
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -243,6 +558,54 @@ def get_answer(question):
         }
         return answer_data
 
+def get_answer_stream(question, async_relevance=False):
+    """
+    Streaming variant of get_answer.
+    Returns a generator of answer text pieces and the answer data dictionary. The dictionary is
+    completed with usage, cost, relevance, response_time, first_token_time and the stage timings
+    once the generator is exhausted.
+    """
+    answer_data = {}
+
+    def tokens():
+        start_time = time.time()
+        try:
+            prepared_data, question_embedding, prompt = prepare_prompt(question, start_time, answer_data)
+            if prepared_data is not None:
+                prepared_data['first_token_time'] = prepared_data['response_time']
+                answer_data.update(prepared_data)
+                yield prepared_data['answer']
+                return
+
+            llm_result = {}
+            stage_start = time.time()
+            for token in llm_stream(prompt, llm_result):
+                if 'first_token_time' not in answer_data:
+                    answer_data['first_token_time'] = time.time() - start_time
+                yield token
+            # Includes the time the caller took to consume the tokens
+            answer_data['llm_time'] = time.time() - stage_start
+
+            # The answer excludes the error notice that follows a partial answer
+            llm_failed = llm_result.pop('failed')
+            answer_data.update(llm_result)
+            finalize_answer(question, question_embedding, answer_data, start_time, cache_answer=not llm_failed,
+                            async_relevance=async_relevance)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            answer_data.update({
+                'answer': f"An error occurred: {e}",
+                'response_time': time.time() - start_time,
+                'first_token_time': time.time() - start_time,
+                'relevance': "N/A",
+                'model_used': "N/A",
+                'total_tokens': 0,
+                'openai_cost': 0.0
+            })
+            yield answer_data['answer']
+
+    return tokens(), answer_data
+
 
 if __name__ == "__main__":
     question = get_user_question()
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute, holding at most
+    capacity tokens (one minute's worth by default).
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount):
+        """
+        Takes amount tokens and returns the seconds to wait until they are covered.
+        Requests larger than the capacity are capped, so they wait at most one full refill.
+        """
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount):
+        """
+        Returns (positive amount) or takes (negative amount) tokens after the fact,
+        e.g. once the actual token usage of a request is known.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Limits requests per minute and tokens per minute, like the OpenAI rate limits.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=200000):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, estimated_tokens=0):
+        """
+        Reserves one request with estimated_tokens tokens and returns the seconds to wait before sending it.
+        """
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and estimated_tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+    def acquire(self, estimated_tokens=0):
+        """
+        Blocks until one request with estimated_tokens tokens fits in both limits.
+        """
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens=0):
+        """
+        Asyncio variant of acquire: waits without blocking the event loop.
+        """
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """
+        Corrects the token bucket with the actual usage of a request admitted with estimated_tokens.
+        """
+        if self.tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+import time
+
+# Registry of the expensive shared objects: the embedding model and the OpenAI and Elasticsearch clients.
+# Each one is built on first use, once per process, and shared by every module that asks for it
+# (rag.py and evaluation.py use the same model). In the Streamlit app the builders also go through
+# st.cache_resource (see use_streamlit_cache), so script reruns and module reloads reuse them.
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+ES_HOST = os.getenv('ES_HOST', 'localhost')
+# URL of embedding_server.py, e.g. http://localhost:8002; the model is then not loaded in this process
+EMBEDDING_SERVICE_URL = os.getenv('EMBEDDING_SERVICE_URL')
+
+instances = {}
+build_times = {}
+registry_lock = threading.Lock()
+build_locks = {}  # One lock per resource, so loading the model does not hold up the clients
+
+
+def build_embedding_model():
+    if EMBEDDING_SERVICE_URL:
+        from embedding_client import EmbeddingServiceClient
+        return EmbeddingServiceClient(EMBEDDING_SERVICE_URL)
+    from encoder import load_encoder  # Imports sentence_transformers and torch, so only on first use
+    return load_encoder(EMBEDDING_MODEL_NAME)
+
+
+def build_openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def build_es_client():
+    from elasticsearch import Elasticsearch
+    return Elasticsearch([f'http://{ES_HOST}:9200'])
+
+
+builders = {
+    'embedding_model': build_embedding_model,
+    'openai_client': build_openai_client,
+    'es_client': build_es_client,
+}
+
+
+def get(name):
+    """
+    Returns the shared resource, building it on first use.
+    """
+    resource = instances.get(name)
+    if resource is None:
+        with registry_lock:
+            build_lock = build_locks.setdefault(name, threading.Lock())
+        with build_lock:
+            resource = instances.get(name)
+            if resource is None:
+                start_time = time.time()
+                resource = builders[name]()
+                build_times[name] = time.time() - start_time
+                instances[name] = resource
+                logging.info(f"Built {name} in {build_times[name]:.2f}s.")
+    return resource
+
+
+def set_resource(name, resource):
+    """
+    Replaces a resource, e.g. with a client of a local stub in benchmarks.
+    """
+    with registry_lock:
+        instances[name] = resource
+
+
+def is_loaded(name):
+    return name in instances
+
+
+def preload(names=None):
+    """
+    Builds the given resources (all by default) up front, e.g. before measuring steady-state latency.
+    """
+    for name in names or list(builders):
+        get(name)
+
+
+def use_streamlit_cache():
+    """
+    Routes the builders through st.cache_resource, so one instance per server process is shared by
+    all sessions and survives reruns. Returns False when Streamlit is not installed.
+    """
+    try:
+        import streamlit as st
+    except ImportError:
+        return False
+    with registry_lock:
+        for name, builder in builders.items():
+            if not hasattr(builder, 'clear'):  # Already wrapped
+                builders[name] = st.cache_resource(show_spinner=False)(builder)
+    return True
+
+
+def get_embedding_model():
+    return get('embedding_model')
+
+
+def get_openai_client():
+    return get('openai_client')
+
+
+def get_es_client():
+    return get('es_client')
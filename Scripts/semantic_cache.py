@@ -0,0 +1,99 @@
+import threading
+import time
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Cache of past answers keyed on question embeddings.
+    A lookup returns the answer of the most similar cached question when its cosine
+    similarity reaches the threshold. Entries expire after ttl seconds and the least
+    recently used entry is evicted once max_entries is reached.
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.embeddings = None  # (max_entries, dims) normalised vectors, allocated on first store
+        self.entries = [None] * max_entries
+        self.expires_at = np.zeros(max_entries)
+        self.last_used = np.zeros(max_entries)
+        self.valid = np.zeros(max_entries, dtype=bool)
+        self.catalog_version = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def lookup(self, embedding):
+        """
+        Returns a copy of the cached answer data and its similarity, or (None, None).
+        """
+        vector = self.normalize(embedding)
+        now = time.time()
+        with self.lock:
+            if vector is None or self.embeddings is None:
+                self.misses += 1
+                return None, None
+            self.valid &= self.expires_at > now
+            if not self.valid.any():
+                self.misses += 1
+                return None, None
+            scores = self.embeddings @ vector
+            scores[~self.valid] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None, None
+            self.last_used[best] = now
+            self.hits += 1
+            return dict(self.entries[best]), float(scores[best])
+
+    def store(self, question, embedding, answer_data):
+        """
+        Adds an answer to the cache, evicting an expired or the least recently used entry when full.
+        """
+        vector = self.normalize(embedding)
+        if vector is None:
+            return
+        now = time.time()
+        with self.lock:
+            if self.embeddings is None:
+                self.embeddings = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            self.valid &= self.expires_at > now
+            free = np.flatnonzero(~self.valid)
+            slot = int(free[0]) if len(free) else int(np.argmin(self.last_used))
+            self.embeddings[slot] = vector
+            self.entries[slot] = dict(answer_data, question=question)
+            self.expires_at[slot] = now + self.ttl
+            self.last_used[slot] = now
+            self.valid[slot] = True
+
+    def invalidate(self):
+        """
+        Drops every cached answer.
+        """
+        with self.lock:
+            self.valid[:] = False
+            self.entries = [None] * self.max_entries
+
+    def set_catalog_version(self, version):
+        """
+        Invalidates the cache when the catalog version differs from the one the answers were built on.
+        """
+        with self.lock:
+            changed = self.catalog_version is not None and version != self.catalog_version
+            self.catalog_version = version
+        if changed:
+            self.invalidate()
+        return changed
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': int(self.valid.sum())}
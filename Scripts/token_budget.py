@@ -0,0 +1,115 @@
+import logging
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Fields of a product document in packing order, with the most tokens each may use (None = untrimmed).
+# Short identifying fields come first, so every retrieved product is at least named; the long
+# ingredients and reviews blobs are trimmed and are the first to be dropped when the budget runs out.
+CONTEXT_FIELDS = [
+    ('cosmetic_name', None),
+    ('brand_name', None),
+    ('price', None),
+    ('about', 200),
+    ('recommended', 20),
+    ('ingredients', 120),
+    ('reviews', 150),
+]
+# Used for documents indexed before the separate fields were stored
+TEXT_FIELD_MAX_TOKENS = 300
+# A field is not started when fewer tokens than this are left in the budget
+MIN_FIELD_TOKENS = 16
+
+encoding = None
+encoding_lock = threading.Lock()
+encoding_failed = False
+
+
+def get_encoding(model_name='gpt-4o-mini'):
+    """
+    Returns the tiktoken encoding of the model, or None when tiktoken or its encoding files are
+    unavailable (token counts are then estimated from the text length).
+    """
+    global encoding, encoding_failed
+    if encoding is None and not encoding_failed:
+        with encoding_lock:
+            if encoding is None and not encoding_failed:
+                try:
+                    encoding = tiktoken.encoding_for_model(model_name)
+                except Exception as e:
+                    encoding_failed = True
+                    logging.warning(f"Tokenizer for {model_name} unavailable, estimating token counts: {e}")
+    return encoding
+
+
+def count_tokens(text, model_name='gpt-4o-mini'):
+    """
+    Counts the tokens of a text with the model's tokenizer.
+    """
+    enc = get_encoding(model_name)
+    if enc is None:
+        return (len(text) + 3) // 4  # About 4 characters per token for English text
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def trim_to_tokens(text, max_tokens, model_name='gpt-4o-mini'):
+    """
+    Cuts a text down to at most max_tokens tokens, marking the cut with an ellipsis.
+    """
+    enc = get_encoding(model_name)
+    if enc is None:
+        max_chars = max_tokens * 4
+        return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + '...'
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens - 1]).rstrip() + '...'
+
+
+def field_label(field):
+    return field.replace('_', ' ').title()
+
+
+def hit_fields(hit):
+    """
+    Returns the fields of a hit by name; documents indexed before the separate fields
+    were stored have a single 'text' field.
+    """
+    source = hit.get('_source', {})
+    fields = source.get('fields')
+    if not fields:
+        text = source.get('text')
+        return {'text': text} if text else {}
+    return {field: value for field, value in fields.items() if value}
+
+
+def pack_context(hits, max_tokens, model_name='gpt-4o-mini'):
+    """
+    Builds the context from hits ordered by score within a token budget.
+    Fields are added in CONTEXT_FIELDS order across all hits, best hit first, so low-value fields
+    of the best hits are dropped before the names of the others. Hits without a field skip it.
+    Untrimmed fields (the names and price) are added whenever any budget is left; the trimmed ones
+    are not started with fewer than MIN_FIELD_TOKENS left. Returns the context and its token count.
+    """
+    remaining = max_tokens
+    sections = [[] for _ in hits]
+    per_hit = [hit_fields(hit) for hit in hits]
+    # The legacy text field holds the name too, so it is packed at the level of the names
+    for field, field_max_tokens in [('text', TEXT_FIELD_MAX_TOKENS)] + CONTEXT_FIELDS:
+        for i, fields in enumerate(per_hit):
+            value = fields.get(field)
+            if not value:
+                continue
+            if remaining < (2 if field_max_tokens is None else MIN_FIELD_TOKENS):
+                continue
+            line = str(value) if field == 'text' else f"{field_label(field)}: {value}"
+            limit = min(field_max_tokens or remaining, remaining - 1)  # One token is kept for the line break
+            line = trim_to_tokens(line, limit, model_name)
+            remaining -= count_tokens(line, model_name) + 1
+            sections[i].append(line)
+
+    context = "\n\n".join("\n".join(lines) for lines in sections if lines)
+    return context, max_tokens - remaining
@@ -12,16 +12,28 @@ logging.basicConfig(level=logging.INFO)
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
+# Add the Scripts directory so modules imported by rag.py resolve as well
+sys.path.append(os.path.join(parent_dir, 'Scripts'))
 
-from Scripts.rag import get_answer
+from Scripts.rag import get_answer_stream, get_embedding_cache_stats, RELEVANCE_ASYNC
+import resources
+
+# Build the model and clients once per server process, shared by all sessions and reruns
+resources.use_streamlit_cache()
 from db import (
     generate_conversation_id,
     save_conversation,
     save_feedback,
+    update_conversation_relevance,
     get_recent_conversations,
-    get_feedback_stats
+    get_feedback_stats,
+    get_write_behind_stats,
+    check_partitions
 )
 
+# Create the partitions of the coming months; runs at most once a day per server process
+check_partitions()
+
 # Initialize session state variables
 if 'conversation_history' not in st.session_state:
     st.session_state['conversation_history'] = []
@@ -31,6 +43,8 @@ if 'last_answer' not in st.session_state:
     st.session_state['last_answer'] = None
 if 'last_processing_time' not in st.session_state:
     st.session_state['last_processing_time'] = None
+if 'last_first_token_time' not in st.session_state:
+    st.session_state['last_first_token_time'] = None
 if 'last_relevance' not in st.session_state:
     st.session_state['last_relevance'] = None
 if 'last_model_used' not in st.session_state:
@@ -47,24 +61,32 @@ st.title("AI-Powered Skincare Chatbot")
 user_input = st.text_input("Enter your question:")
 ask_button = st.button("Ask")
 
+answer_streamed = False
 if ask_button and user_input:
-    with st.spinner('Processing your question...'):
-        start_time = time.time()
-        # Generate a unique conversation ID
-        conversation_id = generate_conversation_id()
-        # Get the answer from the LLM
-        answer_data = get_answer(user_input)
-        end_time = time.time()
-        processing_time = end_time - start_time
+    start_time = time.time()
+    # Generate a unique conversation ID
+    conversation_id = generate_conversation_id()
+    # Stream the answer from the LLM as it is generated
+    st.subheader("Answer:")
+    tokens, answer_data = get_answer_stream(user_input, async_relevance=RELEVANCE_ASYNC)
+    st.write_stream(tokens)
+    answer_streamed = True
+    end_time = time.time()
+    processing_time = end_time - start_time
+    # Relevance is scored in the background and written to the conversation once it is ready
+    relevance_future = answer_data.pop('relevance_future', None)
 
     # Debug: Display answer_data contents
     logging.info(f"answer_data: {answer_data}")
+    logging.info(f"Embedding cache: {get_embedding_cache_stats()}")
+    logging.info(f"Write-behind queue: {get_write_behind_stats()}")
 
     # Ensure all required keys are present in answer_data
-    required_keys = ["answer", "model_used", "response_time", "relevance", "total_tokens", "openai_cost"]
+    required_keys = ["answer", "model_used", "response_time", "first_token_time", "relevance", "total_tokens",
+                     "openai_cost"]
     for key in required_keys:
         if key not in answer_data or answer_data[key] is None:
-            if key in ["response_time", "openai_cost"]:
+            if key in ["response_time", "first_token_time", "openai_cost"]:
                 answer_data[key] = 0.0
             elif key == "total_tokens":
                 answer_data[key] = 0
@@ -73,6 +95,7 @@ if ask_button and user_input:
 
     # Convert numerical values to native Python types
     answer_data["response_time"] = float(answer_data["response_time"])
+    answer_data["first_token_time"] = float(answer_data["first_token_time"])
     answer_data["total_tokens"] = int(answer_data["total_tokens"])
     answer_data["openai_cost"] = float(answer_data["openai_cost"])
 
@@ -82,11 +105,18 @@ if ask_button and user_input:
 
     # Save the conversation to the database
     try:
-        save_conversation(conversation_id, user_input, answer_data)
+        timestamp = save_conversation(conversation_id, user_input, answer_data)
+        if relevance_future is not None:
+            relevance_future.add_done_callback(
+                lambda future, conversation_id=conversation_id, timestamp=timestamp: update_conversation_relevance(
+                    conversation_id, timestamp, *future.result()
+                )
+            )
         # Store the conversation_id and other data in session state
         st.session_state['last_conversation_id'] = conversation_id
         st.session_state['last_answer'] = answer_data["answer"]
         st.session_state['last_processing_time'] = processing_time
+        st.session_state['last_first_token_time'] = answer_data["first_token_time"]
         st.session_state['last_relevance'] = answer_data.get('relevance', 'N/A')
         st.session_state['last_model_used'] = answer_data.get('model_used', 'N/A')
         st.session_state['last_total_tokens'] = answer_data.get('total_tokens', 'N/A')
@@ -107,13 +137,15 @@ if ask_button and user_input:
 
 # Display the answer and feedback buttons if a conversation exists
 if st.session_state.get('last_conversation_id', None):
-    # Display the answer
-    st.subheader("Answer:")
-    st.write(st.session_state['last_answer'])
+    # Display the answer, unless it was just streamed above
+    if not answer_streamed:
+        st.subheader("Answer:")
+        st.write(st.session_state['last_answer'])
 
     # Display monitoring information
     st.subheader("Monitoring Information")
     st.write(f"Response time: {st.session_state['last_processing_time']:.2f} seconds")
+    st.write(f"Time to first token: {st.session_state['last_first_token_time']:.2f} seconds")
     st.write(f"Relevance: {st.session_state['last_relevance']}")
     st.write(f"Model used: {st.session_state['last_model_used']}")
     st.write(f"Total tokens: {st.session_state['last_total_tokens']}")
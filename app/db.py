@@ -1,9 +1,15 @@
 # db.py
 import psycopg2
-from psycopg2.extras import RealDictCursor, DictCursor
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import RealDictCursor, DictCursor, execute_values
+from contextlib import contextmanager
+import atexit
+import queue
+import threading
+import time
 import uuid
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import logging
 
 # Configure logging
@@ -16,6 +22,45 @@ DB_NAME = os.getenv('DB_NAME', 'my_database')
 DB_USER = os.getenv('DB_USER', 'db_user')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'db_password')
 
+# Connection pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))  # Seconds to establish a new connection
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # Seconds to wait for a free pooled connection
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_HEALTH_CHECK_INTERVAL', '30'))  # Idle seconds before a ping
+
+# Write-behind configuration: when enabled, conversations and feedback are queued and written
+# in batches by a background thread instead of one commit per row on the request path
+DB_WRITE_BEHIND = os.getenv('DB_WRITE_BEHIND', '0') == '1'
+DB_WRITE_QUEUE_SIZE = int(os.getenv('DB_WRITE_QUEUE_SIZE', '1000'))
+DB_WRITE_QUEUE_TIMEOUT = float(os.getenv('DB_WRITE_QUEUE_TIMEOUT', '5'))  # Seconds to wait when the queue is full
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', '100'))
+DB_WRITE_FLUSH_INTERVAL = float(os.getenv('DB_WRITE_FLUSH_INTERVAL', '1.0'))  # Seconds between flushes
+
+# Durations of the answer pipeline stages, in seconds, stored with each conversation
+STAGE_TIME_COLUMNS = ["embedding_time", "retrieval_time", "prompt_time", "llm_time", "relevance_time"]
+CONVERSATION_COLUMNS = (
+    "conversation_id, question, answer, model_used, response_time, first_token_time, "
+    "relevance, total_tokens, openai_cost, timestamp, " + ", ".join(STAGE_TIME_COLUMNS)
+)
+FEEDBACK_COLUMNS = "conversation_id, feedback, created_at"
+# Matches the whole primary key, so only the partition of each conversation is searched
+RELEVANCE_UPDATE_QUERY = """
+UPDATE conversations AS c SET relevance = v.relevance, relevance_time = v.relevance_time::FLOAT
+FROM (VALUES %s) AS v (conversation_id, timestamp, relevance, relevance_time)
+WHERE c.conversation_id = v.conversation_id AND c.timestamp = v.timestamp::TIMESTAMP WITH TIME ZONE
+"""
+# Conversation columns added after the initial schema, as (name, type)
+CONVERSATION_ADDED_COLUMNS = [("first_token_time", "FLOAT")] + [(column, "FLOAT") for column in STAGE_TIME_COLUMNS]
+
+# Partitioning configuration: conversations and feedback are range-partitioned by month
+# on the column below, and partitions older than the retention are detached or dropped
+PARTITIONED_TABLES = {'conversations': 'timestamp', 'feedback': 'created_at'}
+DB_PARTITION_MONTHS_AHEAD = int(os.getenv('DB_PARTITION_MONTHS_AHEAD', '3'))
+DB_RETENTION_MONTHS = int(os.getenv('DB_RETENTION_MONTHS', '12'))  # 0 keeps every partition
+DB_PARTITION_CHECK_INTERVAL = float(os.getenv('DB_PARTITION_CHECK_INTERVAL', '86400'))  # Seconds between app checks
+RECENT_CONVERSATIONS_DAYS = int(os.getenv('RECENT_CONVERSATIONS_DAYS', '30'))  # Lookback of the history view
+
 def get_db_connection():
     """
     Establishes a connection to the PostgreSQL database.
@@ -26,51 +71,705 @@ def get_db_connection():
             port=DB_PORT,
             dbname=DB_NAME,
             user=DB_USER,
-            password=DB_PASSWORD
+            password=DB_PASSWORD,
+            connect_timeout=DB_CONNECT_TIMEOUT
         )
         return conn
     except Exception as e:
         logging.error(f"Error connecting to the database: {e}")
         raise e  # Re-raise the exception
 
-def create_tables():
+class ConnectionPool:
     """
-    Generates tables for conversations and feedback.
+    Thread-safe pool of PostgreSQL connections with a bounded size.
+    Callers wait up to timeout seconds for a free connection, and connections that were
+    idle for longer than health_check_interval are pinged and replaced if broken.
+    """
+
+    def __init__(self, min_size, max_size, timeout, health_check_interval):
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.last_used = {}
+        self.pool = pg_pool.ThreadedConnectionPool(
+            min_size, max_size,
+            host=DB_HOST,
+            port=DB_PORT,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            connect_timeout=DB_CONNECT_TIMEOUT
+        )
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise pg_pool.PoolError(f"No database connection available within {self.timeout} seconds")
+        try:
+            conn = self.pool.getconn()
+            if not self.is_healthy(conn):
+                logging.warning("Replacing a broken database connection.")
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                conn = self.pool.getconn()
+            return conn
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        try:
+            close = close or bool(conn.closed)
+            # Closed connections are discarded, and their id can be reused by a new connection
+            if close:
+                self.last_used.pop(id(conn), None)
+            else:
+                self.last_used[id(conn)] = time.time()
+            self.pool.putconn(conn, close=close)
+        finally:
+            self.slots.release()
+
+    def is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.time() - self.last_used.get(id(conn), 0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        self.pool.closeall()
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def get_db_pool():
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    Returns the process-wide connection pool, creating it on first use.
+    """
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_pool = ConnectionPool(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT,
+                                         DB_HEALTH_CHECK_INTERVAL)
+    return db_pool
+
+def close_db_pool():
+    """
+    Closes every pooled connection.
+    """
+    global db_pool
+    with db_pool_lock:
+        if db_pool is not None:
+            db_pool.close()
+            db_pool = None
+
+atexit.register(close_db_pool)
+
+@contextmanager
+def db_connection():
+    """
+    Borrows a connection from the pool. The transaction is committed when the block
+    succeeds and rolled back when it raises; the connection always goes back to the pool.
+    """
+    pool = get_db_pool()
+    conn = pool.getconn()
+    broken = False
     try:
-        create_conversations_query = """
-            CREATE TABLE IF NOT EXISTS conversations (
-                conversation_id TEXT PRIMARY KEY,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL,
-                model_used TEXT NOT NULL,
-                response_time FLOAT NOT NULL,
-                relevance TEXT NOT NULL,
-                total_tokens INTEGER NOT NULL,
-                openai_cost FLOAT NOT NULL,
-                timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
-            );
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
+
+class WriteBehindQueue:
+    """
+    Bounded queue of pending conversation, feedback and relevance rows, flushed in batches with
+    multi-row inserts by a background thread. Rows keep their enqueue order, and within a
+    batch conversations are inserted before feedback, so feedback never precedes its conversation.
+    """
+
+    def __init__(self, max_size, batch_size, flush_interval, put_timeout):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.written = 0
+        self.errors = 0
+        self.counter_lock = threading.Lock()  # put() runs on the app threads, write() on the writer thread
+        self.thread = threading.Thread(target=self.run, name='db-write-behind', daemon=True)
+        self.thread.start()
+
+    def put(self, kind, row):
         """
-        create_feedback_query = """
-        CREATE TABLE IF NOT EXISTS feedback (
-            feedback_id SERIAL PRIMARY KEY,
-            conversation_id TEXT REFERENCES conversations(conversation_id),
-            feedback VARCHAR(20) NOT NULL,
-            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-        );
+        Queues a row; blocks up to put_timeout seconds and raises queue.Full when the queue stays full.
         """
-        cursor.execute(create_conversations_query)
-        cursor.execute(create_feedback_query)
-        conn.commit()
+        try:
+            self.queue.put((kind, row), timeout=self.put_timeout)
+        except queue.Full:
+            self.count('errors')
+            raise
+
+    def count(self, counter, n=1):
+        with self.counter_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if None in batch:
+                stopping = True
+            rows = [item for item in batch if item is not None]
+            if rows:
+                self.write(rows)
+            for _ in batch:
+                self.queue.task_done()
+
+    def write(self, rows):
+        try:
+            write_rows(rows)
+            self.count('written', len(rows))
+        except Exception as e:
+            logging.error(f"Error writing a batch of {len(rows)} rows, retrying one by one: {e}")
+            # Write the rows separately so one bad row does not lose the whole batch
+            for row in rows:
+                try:
+                    write_rows([row])
+                    self.count('written')
+                except Exception as row_error:
+                    self.count('errors')
+                    logging.error(f"Error writing queued {row[0]} row: {row_error}")
+
+    def flush(self):
+        """
+        Blocks until every queued row has been written.
+        """
+        self.queue.join()
+
+    def stop(self, timeout=10):
+        """
+        Writes the remaining rows and stops the background thread. When the thread is gone or the
+        queue stays full for timeout seconds, the remaining rows are written from the calling thread.
+        """
+        deadline = time.time() + timeout
+        if self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+                self.thread.join(max(0.0, deadline - time.time()))
+                if self.thread.is_alive():
+                    logging.error(f"Write-behind thread still busy after {timeout}s, {self.queue.qsize()} rows queued.")
+                return
+            except queue.Full:
+                logging.error(f"Write-behind queue still full after {timeout}s, writing the remaining rows directly.")
+        self.drain()
+
+    def drain(self):
+        """
+        Writes every queued row from the calling thread.
+        """
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        rows = [item for item in items if item is not None]
+        for start in range(0, len(rows), self.batch_size):
+            self.write(rows[start:start + self.batch_size])
+        for _ in items:
+            self.queue.task_done()
+
+    def stats(self):
+        with self.counter_lock:
+            return {'queued': self.queue.qsize(), 'written': self.written, 'errors': self.errors}
+
+write_queue = None
+write_queue_lock = threading.Lock()
+
+def get_write_queue():
+    """
+    Returns the process-wide write-behind queue, starting it on first use.
+    """
+    global write_queue
+    if write_queue is None:
+        with write_queue_lock:
+            if write_queue is None:
+                write_queue = WriteBehindQueue(DB_WRITE_QUEUE_SIZE, DB_WRITE_BATCH_SIZE,
+                                               DB_WRITE_FLUSH_INTERVAL, DB_WRITE_QUEUE_TIMEOUT)
+    return write_queue
+
+def stop_write_queue():
+    """
+    Flushes and stops the write-behind queue, if it was started.
+    """
+    global write_queue
+    with write_queue_lock:
+        if write_queue is not None:
+            write_queue.stop()
+            write_queue = None
+
+# Registered after close_db_pool, so it runs first on shutdown and can still use the pool
+atexit.register(stop_write_queue)
+
+def get_write_behind_stats():
+    """
+    Returns the queued, written and error counters of the write-behind queue.
+    """
+    if write_queue is None:
+        return {'queued': 0, 'written': 0, 'errors': 0}
+    return write_queue.stats()
+
+def write_rows(rows):
+    """
+    Writes queued (kind, row) tuples in one transaction: conversations, then feedback,
+    then relevance updates of conversations.
+    """
+    conversations = [row for kind, row in rows if kind == 'conversation']
+    feedback = [row for kind, row in rows if kind == 'feedback']
+    relevance = [row for kind, row in rows if kind == 'relevance']
+    with db_connection() as conn, conn.cursor() as cursor:
+        if conversations:
+            execute_values(cursor, f"INSERT INTO conversations ({CONVERSATION_COLUMNS}) VALUES %s",
+                           conversations)
+        if feedback:
+            execute_values(cursor, f"INSERT INTO feedback ({FEEDBACK_COLUMNS}) VALUES %s", feedback)
+        if relevance:
+            execute_values(cursor, RELEVANCE_UPDATE_QUERY, relevance)
+
+def create_tables():
+    """
+    Generates tables for conversations and feedback.
+    """
+    try:
+        with db_connection() as conn, conn.cursor() as cursor:
+            create_schema(cursor)
+            if is_partitioned(cursor, 'conversations'):
+                create_partitions(cursor, DB_PARTITION_MONTHS_AHEAD)
     except Exception as e:
         logging.error(f"Error creating tables: {e}")
-        conn.rollback()
         raise e  # Re-raise the exception
-    finally:
-        cursor.close()
-        conn.close()
+
+def create_schema(cursor):
+    """
+    Creates the tables partitioned by month, their default partitions, indexes and rollups.
+    Existing unpartitioned tables are left as they are until they are migrated.
+    """
+    # The partition key has to be part of the primary key, and partitioned feedback
+    # cannot reference conversations, so the foreign key is dropped. Feedback is
+    # still only written after its conversation.
+    create_conversations_query = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            conversation_id TEXT NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            model_used TEXT NOT NULL,
+            response_time FLOAT NOT NULL,
+            first_token_time FLOAT,
+            relevance TEXT NOT NULL,
+            total_tokens INTEGER NOT NULL,
+            openai_cost FLOAT NOT NULL,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            embedding_time FLOAT,
+            retrieval_time FLOAT,
+            prompt_time FLOAT,
+            llm_time FLOAT,
+            relevance_time FLOAT,
+            PRIMARY KEY (conversation_id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+    """
+    create_feedback_query = """
+    CREATE TABLE IF NOT EXISTS feedback (
+        feedback_id SERIAL,
+        conversation_id TEXT,
+        feedback VARCHAR(20) NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (feedback_id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    """
+    create_indexes_query = """
+    CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_feedback_conversation_feedback ON feedback (conversation_id, feedback);
+    """
+    cursor.execute(create_conversations_query)
+    add_missing_columns(cursor, 'conversations')
+    cursor.execute(create_feedback_query)
+    for table in PARTITIONED_TABLES:
+        if is_partitioned(cursor, table):
+            # Catches rows outside the monthly partitions until create_partitions moves them
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;")
+        else:
+            logging.warning(f"Table {table} is not partitioned; run dp_prep.py --migrate to partition it.")
+    cursor.execute(create_indexes_query)
+    create_rollup_tables(cursor)
+
+def add_missing_columns(cursor, table):
+    """
+    Adds the columns introduced after the initial schema, for databases created before them.
+    """
+    for column, column_type in CONVERSATION_ADDED_COLUMNS:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type};")
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+def partition_name(table, month):
+    return f"{table}_{month:%Y_%m}"
+
+def create_partition(cursor, table, month):
+    """
+    Creates the partition of a table for one month, moving rows of that month out of the
+    default partition first. Returns True when the partition was created.
+    """
+    name = partition_name(table, month)
+    cursor.execute("SELECT to_regclass(%s)", (name,))
+    if cursor.fetchone()[0] is not None:
+        return False
+
+    column = PARTITIONED_TABLES[table]
+    bounds = (month.isoformat(), add_months(month, 1).isoformat())
+    create_query = f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s);"
+    cursor.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE {column} >= %s AND {column} < %s)", bounds
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(create_query, bounds)
+        return True
+
+    # A partition cannot be added while the default partition holds rows in its range.
+    # The rows are moved straight between partitions, so the rollup triggers on the parent do not fire.
+    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {table}_default;")
+    cursor.execute(create_query, bounds)
+    cursor.execute(f"""
+    WITH moved AS (
+        DELETE FROM {table}_default WHERE {column} >= %s AND {column} < %s RETURNING *
+    )
+    INSERT INTO {name} SELECT * FROM moved;
+    """, bounds)
+    logging.info(f"Moved {cursor.rowcount} rows from {table}_default to {name}.")
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {table}_default DEFAULT;")
+    return True
+
+def create_partitions(cursor, months_ahead, first_month=None):
+    """
+    Creates the monthly partitions of every partitioned table from first_month
+    (the current month by default) up to months_ahead months from now.
+    """
+    current_month = month_start(datetime.now(timezone.utc))
+    month = month_start(first_month) if first_month else current_month
+    created = []
+    while month <= add_months(current_month, months_ahead):
+        for table in PARTITIONED_TABLES:
+            if create_partition(cursor, table, month):
+                created.append(partition_name(table, month))
+        month = add_months(month, 1)
+    if created:
+        logging.info(f"Created partitions: {', '.join(created)}")
+    return created
+
+def ensure_partitions(months_ahead=DB_PARTITION_MONTHS_AHEAD):
+    """
+    Creates the partitions for the current and the next months_ahead months.
+    Meant to run regularly (e.g. with the retention job), so rows never pile up in the default partition.
+    """
+    try:
+        with db_connection() as conn, conn.cursor() as cursor:
+            return create_partitions(cursor, months_ahead)
+    except Exception as e:
+        logging.error(f"Error creating partitions: {e}")
+        raise e  # Re-raise the exception
+
+last_partition_check = 0.0
+partition_check_lock = threading.Lock()
+
+def check_partitions(interval=DB_PARTITION_CHECK_INTERVAL, months_ahead=DB_PARTITION_MONTHS_AHEAD):
+    """
+    Creates the upcoming partitions at most once every interval seconds per process, and warns
+    about rows left in the default partitions. The app calls it on every run, so a long-running
+    server keeps its partitions ahead of time even when the retention job is not scheduled.
+    Errors are logged, not raised, so they never break the app.
+    """
+    global last_partition_check
+    with partition_check_lock:
+        if time.time() - last_partition_check < interval:
+            return
+        last_partition_check = time.time()
+    try:
+        with db_connection() as conn, conn.cursor() as cursor:
+            if not all(is_partitioned(cursor, table) for table in PARTITIONED_TABLES):
+                logging.warning("Conversations and feedback are not partitioned; run dp_prep.py --migrate.")
+                return
+            create_partitions(cursor, months_ahead)
+            for table in PARTITIONED_TABLES:
+                cursor.execute(f"SELECT count(*) FROM {table}_default;")
+                rows = cursor.fetchone()[0]
+                if rows:
+                    logging.warning(f"{rows} rows in {table}_default are outside every monthly partition.")
+    except Exception as e:
+        logging.error(f"Error checking partitions: {e}")
+
+def list_partitions(cursor, table):
+    """
+    Returns (name, month) of the monthly partitions attached to a table, oldest first.
+    """
+    cursor.execute("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    partitions = []
+    for (name,) in cursor.fetchall():
+        try:
+            month = datetime.strptime(name[len(table) + 1:], '%Y_%m').replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue  # The default partition
+        partitions.append((name, month))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def apply_retention(retention_months=DB_RETENTION_MONTHS, drop=True):
+    """
+    Detaches the partitions older than retention_months months and drops them, or keeps
+    them as standalone *_archived tables when drop is False. The rollup tables keep
+    their aggregates, so the dashboard history is not affected.
+    """
+    if retention_months <= 0:
+        logging.info("Retention is disabled.")
+        return []
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -retention_months)
+    removed = []
+    try:
+        with db_connection() as conn, conn.cursor() as cursor:
+            for table in PARTITIONED_TABLES:
+                if not is_partitioned(cursor, table):
+                    logging.warning(f"Table {table} is not partitioned; skipping retention.")
+                    continue
+                for name, month in list_partitions(cursor, table):
+                    if month >= cutoff:
+                        break
+                    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name};")
+                    if drop:
+                        cursor.execute(f"DROP TABLE {name};")
+                    else:
+                        # Frees the name, so the month can be partitioned again if rows arrive for it
+                        cursor.execute(f"ALTER TABLE {name} RENAME TO {name}_archived;")
+                    removed.append(name)
+        logging.info(f"{'Dropped' if drop else 'Detached'} {len(removed)} partitions older than {cutoff:%Y-%m}.")
+        return removed
+    except Exception as e:
+        logging.error(f"Error applying retention: {e}")
+        raise e  # Re-raise the exception
+
+def migrate_to_partitioned_tables(months_ahead=DB_PARTITION_MONTHS_AHEAD):
+    """
+    Migrates unpartitioned conversations and feedback tables in place, in one transaction:
+    the old tables are renamed, the partitioned ones created and the rows copied over.
+    The rollup tables are rebuilt from the copied rows by their triggers.
+    """
+    try:
+        with db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('conversations')")
+            if cursor.fetchone()[0] is None:
+                logging.info("No tables to migrate; creating partitioned tables.")
+                create_schema(cursor)
+                create_partitions(cursor, months_ahead)
+                return False
+            if is_partitioned(cursor, 'conversations') and is_partitioned(cursor, 'feedback'):
+                logging.info("Tables are already partitioned.")
+                return False
+
+            # Constraint and index names have to be freed for the new tables
+            cursor.execute("""
+            ALTER TABLE feedback DROP CONSTRAINT IF EXISTS feedback_conversation_id_fkey;
+            ALTER TABLE feedback DROP CONSTRAINT IF EXISTS feedback_pkey;
+            ALTER TABLE conversations DROP CONSTRAINT IF EXISTS conversations_pkey;
+            DROP INDEX IF EXISTS idx_conversations_timestamp;
+            DROP INDEX IF EXISTS idx_feedback_conversation_feedback;
+            DROP TRIGGER IF EXISTS conversations_rollup ON conversations;
+            DROP TRIGGER IF EXISTS feedback_rollup ON feedback;
+            ALTER TABLE conversations RENAME TO conversations_unpartitioned;
+            ALTER TABLE feedback RENAME TO feedback_unpartitioned;
+            """)
+            add_missing_columns(cursor, 'conversations_unpartitioned')
+            create_schema(cursor)
+
+            cursor.execute("""
+            SELECT LEAST(
+                (SELECT MIN(timestamp) FROM conversations_unpartitioned),
+                (SELECT MIN(created_at) FROM feedback_unpartitioned)
+            )
+            """)
+            first_row = cursor.fetchone()[0]
+            create_partitions(cursor, months_ahead, first_month=first_row.astimezone(timezone.utc) if first_row else None)
+
+            cursor.execute(f"TRUNCATE {', '.join(ROLLUP_TABLES)};")
+            cursor.execute(f"""
+            INSERT INTO conversations ({CONVERSATION_COLUMNS})
+            SELECT {CONVERSATION_COLUMNS} FROM conversations_unpartitioned;
+            """)
+            logging.info(f"Copied {cursor.rowcount} conversations.")
+            # Feedback without a timestamp is filed under the time of its conversation
+            cursor.execute("""
+            INSERT INTO feedback (feedback_id, conversation_id, feedback, created_at)
+            SELECT f.feedback_id, f.conversation_id, f.feedback,
+                   COALESCE(f.created_at, c.timestamp, CURRENT_TIMESTAMP)
+            FROM feedback_unpartitioned f
+            LEFT JOIN conversations_unpartitioned c ON c.conversation_id = f.conversation_id;
+            """)
+            logging.info(f"Copied {cursor.rowcount} feedback rows.")
+            cursor.execute("""
+            SELECT setval(pg_get_serial_sequence('feedback', 'feedback_id'),
+                          COALESCE(MAX(feedback_id), 0) + 1, false)
+            FROM feedback;
+            """)
+            cursor.execute("DROP TABLE feedback_unpartitioned, conversations_unpartitioned;")
+        logging.info("Migrated conversations and feedback to partitioned tables.")
+        return True
+    except Exception as e:
+        logging.error(f"Error migrating to partitioned tables: {e}")
+        raise e  # Re-raise the exception
+
+# Maintained by triggers on conversations and feedback; emptied or dropped whenever those are rebuilt
+ROLLUP_TABLES = ['conversation_stats_minute', 'conversation_stats_hour',
+                 'feedback_stats_minute', 'feedback_stats_hour', 'feedback_totals']
+
+
+def create_rollup_tables(cursor):
+    """
+    Creates the per-minute and per-hour rollup tables read by the dashboard and the stats widget,
+    the triggers that keep them up to date on every insert, and backfills them from existing rows.
+    """
+    for bucket in ('minute', 'hour'):
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS conversation_stats_{bucket} (
+            bucket TIMESTAMP WITH TIME ZONE PRIMARY KEY,
+            conversations INTEGER NOT NULL,
+            cache_hits INTEGER NOT NULL,
+            total_tokens BIGINT NOT NULL,
+            openai_cost FLOAT NOT NULL,
+            response_time_sum FLOAT NOT NULL,
+            response_time_max FLOAT NOT NULL,
+            first_token_time_sum FLOAT NOT NULL,
+            first_token_count INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS feedback_stats_{bucket} (
+            bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+            feedback VARCHAR(20) NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (bucket, feedback)
+        );
+        """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS feedback_totals (
+        feedback VARCHAR(20) PRIMARY KEY,
+        count BIGINT NOT NULL
+    );
+    """)
+
+    # Statement-level triggers aggregate a whole multi-row insert at once
+    conversation_rollups = "\n".join(f"""
+        INSERT INTO conversation_stats_{bucket} AS s
+        SELECT date_trunc('{bucket}', timestamp), COUNT(*),
+               COUNT(*) FILTER (WHERE model_used = 'cache'), SUM(total_tokens), SUM(openai_cost),
+               SUM(response_time), MAX(response_time),
+               COALESCE(SUM(first_token_time), 0), COUNT(first_token_time)
+        FROM new_rows
+        GROUP BY 1
+        ON CONFLICT (bucket) DO UPDATE SET
+            conversations = s.conversations + EXCLUDED.conversations,
+            cache_hits = s.cache_hits + EXCLUDED.cache_hits,
+            total_tokens = s.total_tokens + EXCLUDED.total_tokens,
+            openai_cost = s.openai_cost + EXCLUDED.openai_cost,
+            response_time_sum = s.response_time_sum + EXCLUDED.response_time_sum,
+            response_time_max = GREATEST(s.response_time_max, EXCLUDED.response_time_max),
+            first_token_time_sum = s.first_token_time_sum + EXCLUDED.first_token_time_sum,
+            first_token_count = s.first_token_count + EXCLUDED.first_token_count;
+    """ for bucket in ('minute', 'hour'))
+    feedback_rollups = "\n".join(f"""
+        INSERT INTO feedback_stats_{bucket} AS s
+        SELECT date_trunc('{bucket}', COALESCE(created_at, CURRENT_TIMESTAMP)), feedback, COUNT(*)
+        FROM new_rows
+        GROUP BY 1, 2
+        ON CONFLICT (bucket, feedback) DO UPDATE SET count = s.count + EXCLUDED.count;
+    """ for bucket in ('minute', 'hour'))
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION rollup_conversations() RETURNS trigger AS $$
+    BEGIN
+        {conversation_rollups}
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION rollup_feedback() RETURNS trigger AS $$
+    BEGIN
+        {feedback_rollups}
+        INSERT INTO feedback_totals AS s
+        SELECT feedback, COUNT(*) FROM new_rows GROUP BY 1
+        ON CONFLICT (feedback) DO UPDATE SET count = s.count + EXCLUDED.count;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS conversations_rollup ON conversations;
+    CREATE TRIGGER conversations_rollup AFTER INSERT ON conversations
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION rollup_conversations();
+
+    DROP TRIGGER IF EXISTS feedback_rollup ON feedback;
+    CREATE TRIGGER feedback_rollup AFTER INSERT ON feedback
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION rollup_feedback();
+    """)
+
+    # Backfill empty rollups from rows written before the triggers existed
+    for bucket in ('minute', 'hour'):
+        cursor.execute(f"""
+        INSERT INTO conversation_stats_{bucket}
+        SELECT date_trunc('{bucket}', timestamp), COUNT(*),
+               COUNT(*) FILTER (WHERE model_used = 'cache'), SUM(total_tokens), SUM(openai_cost),
+               SUM(response_time), MAX(response_time),
+               COALESCE(SUM(first_token_time), 0), COUNT(first_token_time)
+        FROM conversations
+        WHERE NOT EXISTS (SELECT 1 FROM conversation_stats_{bucket})
+        GROUP BY 1;
+
+        INSERT INTO feedback_stats_{bucket}
+        SELECT date_trunc('{bucket}', COALESCE(created_at, CURRENT_TIMESTAMP)), feedback, COUNT(*)
+        FROM feedback
+        WHERE NOT EXISTS (SELECT 1 FROM feedback_stats_{bucket})
+        GROUP BY 1, 2;
+        """)
+    cursor.execute("""
+    INSERT INTO feedback_totals
+    SELECT feedback, COUNT(*) FROM feedback
+    WHERE NOT EXISTS (SELECT 1 FROM feedback_totals)
+    GROUP BY 1;
+    """)
 
 def generate_conversation_id():
     """
@@ -81,116 +780,133 @@ def generate_conversation_id():
 def save_conversation(conversation_id, question, answer_data):
     """
     Saves the question and answer to the conversations table.
+    Returns the timestamp of the conversation, which identifies it together with its id.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
     timestamp = datetime.now()
+    row = (
+        conversation_id,
+        question,
+        answer_data.get("answer", ""),
+        answer_data.get("model_used", "Unknown"),
+        float(answer_data.get("response_time", 0.0)),
+        answer_data.get("first_token_time"),
+        str(answer_data.get("relevance", "N/A")),
+        int(answer_data.get("total_tokens", 0)),
+        float(answer_data.get("openai_cost", 0.0)),
+        timestamp,
+    ) + tuple(answer_data.get(column) for column in STAGE_TIME_COLUMNS)
     try:
-        insert_query = """
-        INSERT INTO conversations 
-        (conversation_id, question, answer, model_used, response_time, relevance, 
-         total_tokens, openai_cost, timestamp)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        if DB_WRITE_BEHIND:
+            get_write_queue().put('conversation', row)
+            logging.info(f"Conversation {conversation_id} queued for saving.")
+            return timestamp
+        placeholders = ", ".join(["%s"] * len(row))
+        insert_query = f"""
+        INSERT INTO conversations ({CONVERSATION_COLUMNS})
+        VALUES ({placeholders})
         """
-        cursor.execute(insert_query,
-                       (
-                           conversation_id,
-                           question,
-                           answer_data.get("answer", ""),
-                           answer_data.get("model_used", "Unknown"),
-                           float(answer_data.get("response_time", 0.0)),
-                           str(answer_data.get("relevance", "N/A")),
-                           int(answer_data.get("total_tokens", 0)),
-                           float(answer_data.get("openai_cost", 0.0)),
-                           timestamp,
-                       ),
-                   )
-        conn.commit()
+        with db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(insert_query, row)
         logging.info(f"Conversation {conversation_id} saved successfully.")
+        return timestamp
     except Exception as e:
         logging.error(f"Error saving conversation: {e}")
-        conn.rollback()
         raise e  # Re-raise the exception
-    finally:
-        cursor.close()
-        conn.close()
 
 def save_feedback(conversation_id, feedback):
     """
     Saves the user feedback to the feedback table.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
     timestamp = datetime.now()
+    row = (conversation_id, feedback, timestamp)
     try:
-        insert_query = """
-        INSERT INTO feedback (conversation_id, feedback, timestamp)
+        if DB_WRITE_BEHIND:
+            # Goes through the same queue as conversations, so it is written after its conversation
+            get_write_queue().put('feedback', row)
+            logging.info(f"Feedback for conversation {conversation_id} queued for saving.")
+            return
+        insert_query = f"""
+        INSERT INTO feedback ({FEEDBACK_COLUMNS})
         VALUES (%s, %s, %s)
         """
-        cursor.execute(insert_query, (conversation_id, feedback, timestamp))
-        conn.commit()
+        with db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(insert_query, row)
         logging.info(f"Feedback for conversation {conversation_id} saved successfully.")
     except Exception as e:
         logging.error(f"Error saving feedback: {e}")
-        conn.rollback()
         raise e  # Re-raise the exception
-    finally:
-        cursor.close()
-        conn.close()
 
-def get_recent_conversations(limit=10, relevance_filter=None):
+def update_conversation_relevance(conversation_id, timestamp, relevance, relevance_time=None):
+    """
+    Stores the relevance (and the time it took to score) of a conversation that was saved before
+    its relevance was scored. timestamp is the one returned by save_conversation.
+    """
+    row = (conversation_id, timestamp, str(relevance), relevance_time)
+    try:
+        if DB_WRITE_BEHIND:
+            # Queued behind the conversation insert, so the update always finds its row
+            get_write_queue().put('relevance', row)
+            return
+        with db_connection() as conn, conn.cursor() as cursor:
+            execute_values(cursor, RELEVANCE_UPDATE_QUERY, [row])
+        logging.info(f"Relevance of conversation {conversation_id} updated.")
+    except Exception as e:
+        logging.error(f"Error updating relevance: {e}")
+        raise e  # Re-raise the exception
+
+def get_recent_conversations(limit=10, relevance_filter=None, days=RECENT_CONVERSATIONS_DAYS):
     """
     Retrieves recent conversations with an optional relevance filter.
+    Only the last days days are searched, so just the newest partitions are scanned.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
     try:
+        # Feedback is always given after its conversation, so the same bound prunes both tables
+        since = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        if days > 0:
+            since = datetime.now(timezone.utc) - timedelta(days=days)
         if relevance_filter and relevance_filter != "All":
             # Use INNER JOIN to only get conversations with feedback
             select_query = """
             SELECT c.*, f.feedback
             FROM conversations c
-            INNER JOIN feedback f ON c.conversation_id = f.conversation_id
-            WHERE f.feedback = %s
+            INNER JOIN feedback f ON c.conversation_id = f.conversation_id AND f.created_at >= %s
+            WHERE f.feedback = %s AND c.timestamp >= %s
             ORDER BY c.timestamp DESC
             LIMIT %s
             """
-            cursor.execute(select_query, (relevance_filter, limit))
+            params = (since, relevance_filter, since, limit)
         else:
             select_query = """
             SELECT c.*, f.feedback
             FROM conversations c
-            LEFT JOIN feedback f ON c.conversation_id = f.conversation_id
+            LEFT JOIN feedback f ON c.conversation_id = f.conversation_id AND f.created_at >= %s
+            WHERE c.timestamp >= %s
             ORDER BY c.timestamp DESC
             LIMIT %s
             """
-            cursor.execute(select_query, (limit,))
-        conversations = cursor.fetchall()
+            params = (since, since, limit)
+        with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(select_query, params)
+            conversations = cursor.fetchall()
         return conversations
     except Exception as e:
         logging.error(f"Error retrieving conversations: {e}")
         raise e  # Re-raise the exception
-    finally:
-        cursor.close()
-        conn.close()
 
 def get_feedback_stats():
     """
-    Retrieves feedback statistics.
+    Retrieves feedback statistics from the feedback_totals rollup.
     """
-    conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=DictCursor) as cur:
+        with db_connection() as conn, conn.cursor(cursor_factory=DictCursor) as cur:
             cur.execute("""
                     SELECT 
-                        COALESCE(SUM(CASE WHEN feedback = 'RELEVANT' THEN 1 ELSE 0 END), 0) as thumbs_up,
-                        COALESCE(SUM(CASE WHEN feedback = 'NON_RELEVANT' THEN 1 ELSE 0 END), 0) as thumbs_down
-                    FROM feedback
+                        COALESCE(SUM(count) FILTER (WHERE feedback = 'RELEVANT'), 0)::BIGINT as thumbs_up,
+                        COALESCE(SUM(count) FILTER (WHERE feedback = 'NON_RELEVANT'), 0)::BIGINT as thumbs_down
+                    FROM feedback_totals
                 """)
             stats = cur.fetchone()
-            return stats
+        return stats
     except Exception as e:
         logging.error(f"Error retrieving feedback statistics: {e}")
         raise e  # Re-raise the exception
-    finally:
-        conn.close()
@@ -1,31 +1,55 @@
 import os
+import argparse
 #from dotenv import load_dotenv
-from db import create_tables, get_db_connection
+from db import (create_tables, get_db_connection, migrate_to_partitioned_tables, ensure_partitions,
+                apply_retention, DB_RETENTION_MONTHS, ROLLUP_TABLES)
 
 #load_dotenv()
 os.environ['RUN_TIMEZONE_CHECK'] = '0'
 
 if __name__ == "__main__":
-    print("Initializing database...")
-    # Connect to the database
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    parser = argparse.ArgumentParser(description="Initialize, migrate or maintain the database.")
+    parser.add_argument('--migrate', action='store_true',
+                        help="Partition existing conversations and feedback tables in place instead of recreating them.")
+    parser.add_argument('--retention', action='store_true',
+                        help="Create upcoming partitions and remove partitions older than --retention-months.")
+    parser.add_argument('--retention-months', type=int, default=DB_RETENTION_MONTHS,
+                        help="Months of conversations and feedback to keep (0 keeps everything).")
+    parser.add_argument('--detach-only', action='store_true',
+                        help="Detach old partitions but keep them as standalone tables.")
+    args = parser.parse_args()
 
-    # Drop existing tables if they exist
-    try:
-        cursor.execute("DROP TABLE IF EXISTS feedback;")
-        cursor.execute("DROP TABLE IF EXISTS conversations;")
-        conn.commit()
-        print("Existing tables dropped.")
-    except Exception as e:
-        print(f"Error dropping tables: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+    if args.migrate:
+        print("Migrating database...")
+        migrate_to_partitioned_tables()
+        print("Tables migrated successfully.")
+    elif args.retention:
+        ensure_partitions()
+        removed = apply_retention(args.retention_months, drop=not args.detach_only)
+        print(f"Removed {len(removed)} old partitions.")
+    else:
+        print("Initializing database...")
+        # Connect to the database
+        conn = get_db_connection()
+        cursor = conn.cursor()
 
-    # Create new tables
-    create_tables()
-    print("New tables created successfully.")
+        # Drop existing tables if they exist
+        try:
+            cursor.execute("DROP TABLE IF EXISTS feedback;")
+            cursor.execute("DROP TABLE IF EXISTS conversations;")
+            # The rollups would otherwise keep the counts of the dropped rows, as their backfill skips existing buckets
+            cursor.execute(f"DROP TABLE IF EXISTS {', '.join(ROLLUP_TABLES)};")
+            conn.commit()
+            print("Existing tables dropped.")
+        except Exception as e:
+            print(f"Error dropping tables: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+            conn.close()
 
-#
\ No newline at end of file
+        # Create new tables
+        create_tables()
+        print("New tables created successfully.")
+
+#
@@ -0,0 +1,67 @@
+import re
+
+import pytest
+
+from chunking import split_tokens
+
+
+class PieceTokenizer:
+    """
+    Splits every word into pieces of at most 3 characters, like a word-piece tokenizer splits rare words.
+    """
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False, verbose=False):
+        offsets = [(i, min(i + 3, match.end()))
+                   for match in re.finditer(r'\S+', text)
+                   for i in range(match.start(), match.end(), 3)]
+        return {'input_ids': list(range(len(offsets))), 'offset_mapping': offsets}
+
+
+tokenizer = PieceTokenizer()
+
+
+def pieces(text):
+    return [text[start:end] for start, end in tokenizer(text)['offset_mapping']]
+
+
+def assert_windows_cover(text, windows, max_tokens):
+    for window in windows:
+        assert window in text
+        assert len(pieces(window)) <= max_tokens
+    covered = set(piece for window in windows for piece in pieces(window))
+    assert set(pieces(text)) <= covered
+
+
+def test_short_text_is_one_window():
+    assert split_tokens(' oat milk ', tokenizer, max_tokens=8, overlap=2) == ['oat milk']
+    assert split_tokens('   ', tokenizer, max_tokens=8, overlap=2) == []
+
+
+def test_windows_end_at_word_boundaries():
+    text = ' '.join(f"w{i:02d}" for i in range(40))
+    windows = split_tokens(text, tokenizer, max_tokens=10, overlap=3)
+    assert_windows_cover(text, windows, 10)
+    assert all(window.split()[0] in text.split() and window.split()[-1] in text.split() for window in windows)
+
+
+@pytest.mark.parametrize('max_tokens,overlap', [(4, 1), (5, 2), (6, 4)])
+def test_word_longer_than_window(max_tokens, overlap):
+    # 'abcdefghijklmnopqrstuvwxyz' alone is 9 pieces
+    text = 'oat abcdefghijklmnopqrstuvwxyz milk shea'
+    windows = split_tokens(text, tokenizer, max_tokens=max_tokens, overlap=overlap)
+    assert_windows_cover(text, windows, max_tokens)
+    assert windows[-1].endswith('shea')
+
+
+def test_long_word_at_the_end():
+    text = 'oat milk abcdefghijklmnopqrstuvwxyz'
+    windows = split_tokens(text, tokenizer, max_tokens=4, overlap=1)
+    assert_windows_cover(text, windows, 4)
+    assert windows[-1].endswith('xyz')
+
+
+@pytest.mark.parametrize('overlap', [5, 8, 12])
+def test_overlap_at_least_step(overlap):
+    text = ' '.join(f"w{i:02d}" for i in range(30))
+    windows = split_tokens(text, tokenizer, max_tokens=10, overlap=overlap)
+    assert_windows_cover(text, windows, 10)
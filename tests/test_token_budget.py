@@ -0,0 +1,50 @@
+from token_budget import count_tokens, pack_context
+
+
+def make_hit(**fields):
+    return {'_source': {'fields': fields}}
+
+
+def line_tokens(*lines):
+    return sum(count_tokens(line) + 1 for line in lines)
+
+
+FULL_HIT = make_hit(cosmetic_name='Hydra Serum', brand_name='Acme', price='25',
+                    about='A light serum for dry skin. ' * 20, ingredients='Water, Glycerin. ' * 30,
+                    reviews='Great for winter. ' * 40)
+CHUNK_HIT = make_hit(cosmetic_name='Night Cream', reviews='Too greasy for me. ' * 40)
+
+
+def test_fields_are_packed_by_priority_across_heterogeneous_hits():
+    budget = line_tokens('Cosmetic Name: Hydra Serum', 'Cosmetic Name: Night Cream', 'Brand Name: Acme', 'Price: 25')
+    context, tokens = pack_context([FULL_HIT, CHUNK_HIT], budget + 10)
+    assert 'Price: 25' in context
+    assert 'Too greasy' not in context  # The reviews of the second hit come after the price of the first
+    assert tokens <= budget + 10
+
+
+def test_every_field_fits_a_large_budget():
+    context, _ = pack_context([FULL_HIT, CHUNK_HIT], 5000)
+    for text in ['Hydra Serum', 'Acme', 'Price: 25', 'dry skin', 'Glycerin', 'Great for winter', 'Night Cream',
+                 'Too greasy']:
+        assert text in context
+
+
+def test_tight_budget_keeps_the_names_of_later_hits():
+    hits = [make_hit(cosmetic_name=f"Product {i}", about='Long description. ' * 50) for i in range(3)]
+    budget = line_tokens('Cosmetic Name: Product 0', 'Cosmetic Name: Product 1', 'Cosmetic Name: Product 2')
+    context, tokens = pack_context(hits, budget)
+    for i in range(3):
+        assert f"Product {i}" in context
+    assert tokens <= budget
+
+
+def test_budget_is_never_exceeded():
+    for budget in [1, 5, 17, 60, 300]:
+        _, tokens = pack_context([FULL_HIT, CHUNK_HIT, FULL_HIT], budget)
+        assert tokens <= budget
+
+
+def test_legacy_text_hits():
+    context, _ = pack_context([{'_source': {'text': 'Old style document'}}], 100)
+    assert context == 'Old style document'